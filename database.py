@@ -1,330 +1,515 @@
+import asyncio
+import itertools
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 import aiosqlite
 import logging
+import time
 from datetime import datetime
-from typing import Optional, List
-from models import User, Queue, QueueMember
+from typing import Optional, List, Tuple
+from models import User, Queue, QueueMember, JoinStatus, JoinResult, PopStatus, PopResult
 
 logger = logging.getLogger(__name__)
 
+SCHEMA_VERSION = 3
+
+SQL_GET_USER = "SELECT id, username, surname, created_at FROM users WHERE id = ?"
+
+SQL_GET_QUEUE = "SELECT id, name, creator_id, created_at, expires_at FROM queues WHERE id = ? AND expires_at > strftime('%s', 'now')"
+
+SQL_TRY_ADD_TO_QUEUE = "INSERT INTO queue_members (queue_id, user_id) VALUES (?, ?) ON CONFLICT DO NOTHING"
+
+SQL_REMOVE_FROM_QUEUE = "DELETE FROM queue_members WHERE queue_id = ? AND user_id = ?"
+
+SQL_GET_QUEUE_MEMBER = """
+    SELECT qm.queue_id, qm.user_id,
+           (SELECT COUNT(*) FROM queue_members p WHERE p.queue_id = qm.queue_id AND p.seq <= qm.seq),
+           qm.joined_at, u.username, u.surname
+    FROM queue_members qm
+    JOIN users u ON qm.user_id = u.id
+    WHERE qm.queue_id = ? AND qm.user_id = ?
+"""
+
+SQL_PEEK_QUEUE = """
+    SELECT q.name, qm.seq, qm.user_id, qm.joined_at, u.username, u.surname
+    FROM queues q
+    LEFT JOIN queue_members qm ON qm.seq = (
+        SELECT seq FROM queue_members WHERE queue_id = q.id ORDER BY seq ASC LIMIT 1
+    )
+    LEFT JOIN users u ON qm.user_id = u.id
+    WHERE q.id = ? AND q.expires_at > strftime('%s', 'now')
+"""
+
+SQL_COUNT_QUEUE_MEMBERS = "SELECT COUNT(*) FROM queue_members WHERE queue_id = ?"
+
+SQL_GET_QUEUE_MEMBER_NAMES = """
+    SELECT ROW_NUMBER() OVER (ORDER BY qm.seq),
+           CASE WHEN COALESCE(u.surname, '') != '' THEN u.surname || ' @' || u.username ELSE '@' || u.username END
+    FROM queue_members qm
+    JOIN users u ON qm.user_id = u.id
+    WHERE qm.queue_id = ?
+    ORDER BY qm.seq ASC
+"""
+
+SQL_GET_QUEUE_TOP_MEMBERS = """
+    SELECT ROW_NUMBER() OVER (ORDER BY qm.seq),
+           CASE WHEN COALESCE(u.surname, '') != '' THEN u.surname || ' @' || u.username ELSE '@' || u.username END,
+           COUNT(*) OVER (),
+           MAX(qm.user_id = ?) OVER ()
+    FROM queue_members qm
+    JOIN users u ON qm.user_id = u.id
+    WHERE qm.queue_id = ?
+    ORDER BY qm.seq ASC
+    LIMIT ?
+"""
+
+SQL_GET_STATUS = """
+    SELECT q.name,
+           (SELECT COUNT(*) FROM queue_members WHERE queue_id = q.id),
+           (SELECT COUNT(*) FROM queue_members p WHERE p.queue_id = q.id AND p.seq <= qm.seq)
+    FROM queues q
+    LEFT JOIN queue_members qm ON qm.queue_id = q.id AND qm.user_id = ?
+    WHERE q.id = ? AND q.expires_at > strftime('%s', 'now')
+"""
+
 
 class Database:
     
-    def __init__(self, db_path: str = "queue_bot.db"):
+    def __init__(
+        self,
+        db_path: str = "queue_bot.db",
+        readers: int = 4,
+        user_cache_size: int = 10000,
+        user_cache_ttl: float = 300
+    ):
         self.db_path = db_path
+        self.readers = readers
+        self.user_cache_size = user_cache_size
+        self.user_cache_ttl = user_cache_ttl
+        self._user_cache: OrderedDict[int, Tuple[User, float]] = OrderedDict()
+        self._writer = None
+        self._readers = []
+        self._rr = None
+        self._write_lock = None
+    
+    async def _connect(self, query_only: bool = False) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.db_path)
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute("PRAGMA temp_store=MEMORY")
+        await db.execute("PRAGMA cache_size=-64000")
+        await db.execute("PRAGMA busy_timeout=5000")
+        await db.execute("PRAGMA foreign_keys=ON")
+        if query_only:
+            await db.execute("PRAGMA query_only=ON")
+        return db
+    
+    def _reader(self) -> aiosqlite.Connection:
+        return next(self._rr)
+    
+    def _cache_user(self, user: User):
+        self._user_cache[user.id] = (user, time.monotonic() + self.user_cache_ttl)
+        self._user_cache.move_to_end(user.id)
+        if len(self._user_cache) > self.user_cache_size:
+            self._user_cache.popitem(last=False)
+    
+    @asynccontextmanager
+    async def _transaction(self):
+        async with self._write_lock:
+            await self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            await self._writer.commit()
     
     async def init_db(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY,
-                    username TEXT NOT NULL,
-                    surname TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+        self._writer = await self._connect()
+        self._write_lock = asyncio.Lock()
+        await self._writer.execute("PRAGMA journal_mode=WAL")
+        
+        await self._migrate()
+        await self._create_schema()
+        await self._writer.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        await self._writer.commit()
+        
+        self._readers = [await self._connect(query_only=True) for _ in range(self.readers)]
+        self._rr = itertools.cycle(self._readers)
+        logger.info("База данных инициализирована")
+    
+    async def _create_schema(self):
+        await self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY,
+                username TEXT NOT NULL,
+                surname TEXT,
+                created_at INTEGER DEFAULT (strftime('%s', 'now'))
+            )
+        """)
+        
+        await self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS queues (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                creator_id INTEGER NOT NULL,
+                created_at INTEGER DEFAULT (strftime('%s', 'now')),
+                expires_at INTEGER DEFAULT (strftime('%s', 'now') + 86400),
+                FOREIGN KEY (creator_id) REFERENCES users (id)
+            )
+        """)
+        
+        await self._writer.execute("""
+            CREATE TABLE IF NOT EXISTS queue_members (
+                seq INTEGER PRIMARY KEY,
+                queue_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                joined_at INTEGER DEFAULT (strftime('%s', 'now')),
+                UNIQUE (queue_id, user_id),
+                FOREIGN KEY (queue_id) REFERENCES queues (id) ON DELETE CASCADE,
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            )
+        """)
+        
+        await self._writer.execute(
+            "CREATE INDEX IF NOT EXISTS idx_queue_members_cover ON queue_members (queue_id, seq, user_id, joined_at)"
+        )
+        await self._writer.execute("CREATE INDEX IF NOT EXISTS idx_queues_expires_at ON queues (expires_at)")
+    
+    async def _migrate(self):
+        async with self._writer.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+        if version >= SCHEMA_VERSION:
+            return
+        
+        async with self._writer.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'queues'"
+        ) as cursor:
+            if not await cursor.fetchone():
+                return
+        
+        if version < 1:
+            try:
+                await self._writer.execute("ALTER TABLE users ADD COLUMN surname TEXT")
+            except aiosqlite.OperationalError:
+                pass
+        
+        if version < 2:
+            await self._rebuild_tables(version)
+        await self._writer.execute("DROP INDEX IF EXISTS idx_queue_members_queue_id")
+    
+    async def _rebuild_tables(self, version: int):
+        def timestamp(column: str) -> str:
+            if version < 1:
+                return f"CAST(strftime('%s', {column}) AS INTEGER)"
+            return column
+        
+        await self._writer.execute("PRAGMA foreign_keys=OFF")
+        try:
+            await self._writer.execute("BEGIN")
+            for index in ("idx_queue_members_queue_id", "idx_queue_members_position", "idx_queues_expires_at"):
+                await self._writer.execute(f"DROP INDEX IF EXISTS {index}")
+            for table in ("users", "queues", "queue_members"):
+                await self._writer.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
             
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS queues (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    creator_id INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    expires_at TIMESTAMP DEFAULT (datetime('now', '+1 day')),
-                    FOREIGN KEY (creator_id) REFERENCES users (id)
-                )
-            """)
+            await self._create_schema()
             
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS queue_members (
-                    queue_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    position INTEGER NOT NULL,
-                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    PRIMARY KEY (queue_id, user_id),
-                    FOREIGN KEY (queue_id) REFERENCES queues (id) ON DELETE CASCADE,
-                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-                )
+            await self._writer.execute(f"""
+                INSERT INTO users (id, username, surname, created_at)
+                SELECT id, username, surname, {timestamp('created_at')}
+                FROM users_legacy
+            """)
+            await self._writer.execute(f"""
+                INSERT INTO queues (id, name, creator_id, created_at, expires_at)
+                SELECT id, name, creator_id, {timestamp('created_at')}, {timestamp('expires_at')}
+                FROM queues_legacy
+            """)
+            await self._writer.execute(f"""
+                INSERT INTO queue_members (queue_id, user_id, joined_at)
+                SELECT queue_id, user_id, {timestamp('joined_at')}
+                FROM queue_members_legacy
+                ORDER BY queue_id, position
             """)
             
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_queue_members_queue_id ON queue_members (queue_id)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_queue_members_position ON queue_members (queue_id, position)")
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_queues_expires_at ON queues (expires_at)")
-            
-            try:
-                await db.execute("ALTER TABLE users ADD COLUMN surname TEXT")
-            except:
-                pass
-            
-            await db.commit()
-            logger.info("База данных инициализирована")
+            for table in ("queue_members", "queues", "users"):
+                await self._writer.execute(f"DROP TABLE {table}_legacy")
+            await self._writer.commit()
+        except Exception:
+            await self._writer.rollback()
+            raise
+        finally:
+            await self._writer.execute("PRAGMA foreign_keys=ON")
+        logger.info("База данных обновлена до версии схемы %s", SCHEMA_VERSION)
+    
+    async def close(self):
+        for reader in self._readers:
+            await reader.close()
+        self._readers = []
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
     
     async def create_user(self, user_id: int, username: str) -> User:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._transaction() as db:
             await db.execute(
                 "INSERT INTO users (id, username, surname) VALUES (?, ?, ?)",
                 (user_id, username, "")
             )
-            await db.commit()
-            return User(id=user_id, username=username, surname="", created_at=datetime.now())
+        user = User(id=user_id, username=username, surname="", created_at=datetime.now())
+        self._cache_user(user)
+        return user
     
     async def get_user(self, user_id: int) -> Optional[User]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT id, username, surname, created_at FROM users WHERE id = ?",
-                (user_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return User(id=row[0], username=row[1], surname=row[2] or "", created_at=datetime.fromisoformat(row[3]))
-                return None
+        cached = self._user_cache.get(user_id)
+        if cached and cached[1] > time.monotonic():
+            self._user_cache.move_to_end(user_id)
+            return cached[0]
+        
+        async with self._reader().execute(
+            SQL_GET_USER,
+            (user_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+            if row:
+                user = User(id=row[0], username=row[1], surname=row[2] or "", created_at=datetime.fromtimestamp(row[3]))
+                self._cache_user(user)
+                return user
+            return None
     
     async def get_all_users(self) -> List[User]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT id, username, surname, created_at FROM users"
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [
-                    User(id=row[0], username=row[1], surname=row[2] or "", created_at=datetime.fromisoformat(row[3]))
-                    for row in rows
-                ]
+        async with self._reader().execute(
+            "SELECT id, username, surname, created_at FROM users"
+        ) as cursor:
+            rows = await cursor.fetchall()
+            return [
+                User(id=row[0], username=row[1], surname=row[2] or "", created_at=datetime.fromtimestamp(row[3]))
+                for row in rows
+            ]
     
     async def get_user_by_username(self, username: str) -> Optional[User]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT id, username, surname, created_at FROM users WHERE username = ?",
-                (username,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return User(id=row[0], username=row[1], surname=row[2] or "", created_at=datetime.fromisoformat(row[3]))
-                return None
+        async with self._reader().execute(
+            "SELECT id, username, surname, created_at FROM users WHERE username = ?",
+            (username,)
+        ) as cursor:
+            row = await cursor.fetchone()
+            if row:
+                return User(id=row[0], username=row[1], surname=row[2] or "", created_at=datetime.fromtimestamp(row[3]))
+            return None
     
     async def update_user_surname(self, user_id: int, surname: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._transaction() as db:
             await db.execute(
                 "UPDATE users SET surname = ? WHERE id = ?",
                 (surname, user_id)
             )
-            await db.commit()
+        cached = self._user_cache.get(user_id)
+        if cached:
+            cached[0].surname = surname
     
     async def create_queue(self, name: str, creator_id: int) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._transaction() as db:
             cursor = await db.execute(
                 "INSERT INTO queues (name, creator_id) VALUES (?, ?)",
                 (name, creator_id)
             )
-            await db.commit()
-            return cursor.lastrowid
+        return cursor.lastrowid
     
     async def get_queue(self, queue_id: int) -> Optional[Queue]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT id, name, creator_id, created_at, expires_at FROM queues WHERE id = ? AND expires_at > datetime('now')",
-                (queue_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return Queue(
+        async with self._reader().execute(
+            SQL_GET_QUEUE,
+            (queue_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+            if row:
+                return Queue(
+                    id=row[0],
+                    name=row[1],
+                    creator_id=row[2],
+                    created_at=datetime.fromtimestamp(row[3]),
+                    expires_at=datetime.fromtimestamp(row[4])
+                )
+            return None
+    
+    async def get_all_queues_with_counts(self) -> List[Tuple[Queue, int]]:
+        async with self._reader().execute("""
+            SELECT q.id, q.name, q.creator_id, q.created_at, q.expires_at, COUNT(qm.user_id)
+            FROM queues q
+            LEFT JOIN queue_members qm ON qm.queue_id = q.id
+            WHERE q.expires_at > strftime('%s', 'now')
+            GROUP BY q.id
+            ORDER BY q.created_at DESC
+        """) as cursor:
+            rows = await cursor.fetchall()
+            return [
+                (
+                    Queue(
                         id=row[0],
                         name=row[1],
                         creator_id=row[2],
-                        created_at=datetime.fromisoformat(row[3]),
-                        expires_at=datetime.fromisoformat(row[4])
-                    )
-                return None
+                        created_at=datetime.fromtimestamp(row[3]),
+                        expires_at=datetime.fromtimestamp(row[4])
+                    ),
+                    row[5]
+                )
+                for row in rows
+            ]
     
-    async def get_all_queues(self) -> List[Queue]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT id, name, creator_id, created_at, expires_at FROM queues WHERE expires_at > datetime('now') ORDER BY created_at DESC"
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [
+    async def get_queues_with_counts_and_membership(self, user_id: int) -> List[Tuple[Queue, int, bool]]:
+        async with self._reader().execute("""
+            SELECT q.id, q.name, q.creator_id, q.created_at, q.expires_at, COUNT(qm.user_id), COALESCE(MAX(qm.user_id = ?), 0)
+            FROM queues q
+            LEFT JOIN queue_members qm ON qm.queue_id = q.id
+            WHERE q.expires_at > strftime('%s', 'now')
+            GROUP BY q.id
+            ORDER BY q.created_at DESC
+        """, (user_id,)) as cursor:
+            rows = await cursor.fetchall()
+            return [
+                (
                     Queue(
                         id=row[0],
                         name=row[1],
                         creator_id=row[2],
-                        created_at=datetime.fromisoformat(row[3]),
-                        expires_at=datetime.fromisoformat(row[4])
-                    )
-                    for row in rows
-                ]
-    
-    async def add_to_queue(self, queue_id: int, user_id: int) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT COALESCE(MAX(position), 0) + 1 FROM queue_members WHERE queue_id = ?",
-                (queue_id,)
-            ) as cursor:
-                position = (await cursor.fetchone())[0]
-            
-            await db.execute(
-                "INSERT INTO queue_members (queue_id, user_id, position) VALUES (?, ?, ?)",
-                (queue_id, user_id, position)
-            )
-            await db.commit()
-            return position
+                        created_at=datetime.fromtimestamp(row[3]),
+                        expires_at=datetime.fromtimestamp(row[4])
+                    ),
+                    row[5],
+                    bool(row[6])
+                )
+                for row in rows
+            ]
     
-    async def remove_from_queue(self, queue_id: int, user_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT position FROM queue_members WHERE queue_id = ? AND user_id = ?",
-                (queue_id, user_id)
-            ) as cursor:
+    async def try_join_queue(self, queue_id: int, user_id: int) -> JoinResult:
+        async with self._transaction() as db:
+            async with db.execute(SQL_GET_QUEUE, (queue_id,)) as cursor:
                 row = await cursor.fetchone()
-                if not row:
-                    return
-                removed_position = row[0]
+            if not row:
+                return JoinResult(JoinStatus.QUEUE_NOT_FOUND)
             
-            await db.execute(
-                "DELETE FROM queue_members WHERE queue_id = ? AND user_id = ?",
-                (queue_id, user_id)
+            queue = Queue(
+                id=row[0],
+                name=row[1],
+                creator_id=row[2],
+                created_at=datetime.fromtimestamp(row[3]),
+                expires_at=datetime.fromtimestamp(row[4])
             )
             
-            await db.execute(
-                "UPDATE queue_members SET position = position - 1 WHERE queue_id = ? AND position > ?",
-                (queue_id, removed_position)
-            )
+            cursor = await db.execute(SQL_TRY_ADD_TO_QUEUE, (queue_id, user_id))
+            if cursor.rowcount == 0:
+                return JoinResult(JoinStatus.ALREADY_MEMBER, queue)
             
-            await db.commit()
+            async with db.execute(SQL_COUNT_QUEUE_MEMBERS, (queue_id,)) as cursor:
+                total = (await cursor.fetchone())[0]
+            return JoinResult(JoinStatus.JOINED, queue, total, total)
+    
+    async def remove_from_queue(self, queue_id: int, user_id: int) -> bool:
+        async with self._transaction() as db:
+            cursor = await db.execute(
+                SQL_REMOVE_FROM_QUEUE,
+                (queue_id, user_id)
+            )
+        return cursor.rowcount > 0
     
     async def get_queue_member(self, queue_id: int, user_id: int) -> Optional[QueueMember]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("""
-                SELECT qm.queue_id, qm.user_id, qm.position, qm.joined_at, u.username, u.surname
-                FROM queue_members qm
-                JOIN users u ON qm.user_id = u.id
-                WHERE qm.queue_id = ? AND qm.user_id = ?
-            """, (queue_id, user_id)) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return QueueMember(
-                        queue_id=row[0],
-                        user_id=row[1],
-                        position=row[2],
-                        joined_at=datetime.fromisoformat(row[3]),
-                        user=User(id=row[1], username=row[4], surname=row[5] or "", created_at=datetime.now())
-                    )
-                return None
+        async with self._reader().execute(SQL_GET_QUEUE_MEMBER, (queue_id, user_id)) as cursor:
+            row = await cursor.fetchone()
+            if row:
+                return QueueMember(
+                    queue_id=row[0],
+                    user_id=row[1],
+                    position=row[2],
+                    joined_at=datetime.fromtimestamp(row[3]),
+                    user=User(id=row[1], username=row[4], surname=row[5] or "", created_at=datetime.now())
+                )
+            return None
     
-    async def get_next_in_queue(self, queue_id: int) -> Optional[QueueMember]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("""
-                SELECT qm.queue_id, qm.user_id, qm.position, qm.joined_at, u.username, u.surname
-                FROM queue_members qm
-                JOIN users u ON qm.user_id = u.id
-                WHERE qm.queue_id = ?
-                ORDER BY qm.position ASC
-                LIMIT 1
-            """, (queue_id,)) as cursor:
+    async def pop_next(self, queue_id: int) -> PopResult:
+        async with self._transaction() as db:
+            async with db.execute(SQL_PEEK_QUEUE, (queue_id,)) as cursor:
                 row = await cursor.fetchone()
-                if row:
-                    return QueueMember(
-                        queue_id=row[0],
-                        user_id=row[1],
-                        position=row[2],
-                        joined_at=datetime.fromisoformat(row[3]),
-                        user=User(id=row[1], username=row[4], surname=row[5] or "", created_at=datetime.now())
-                    )
+            if not row:
+                return PopResult(PopStatus.QUEUE_NOT_FOUND)
+            if row[1] is None:
+                return PopResult(PopStatus.EMPTY, row[0])
+            
+            await db.execute("DELETE FROM queue_members WHERE seq = ?", (row[1],))
+            
+            return PopResult(
+                PopStatus.POPPED,
+                row[0],
+                QueueMember(
+                    queue_id=queue_id,
+                    user_id=row[2],
+                    position=1,
+                    joined_at=datetime.fromtimestamp(row[3]),
+                    user=User(id=row[2], username=row[4], surname=row[5] or "", created_at=datetime.now())
+                )
+            )
+    
+    async def get_status(self, queue_id: int, user_id: int) -> Optional[Tuple[str, int, Optional[int]]]:
+        async with self._reader().execute(SQL_GET_STATUS, (user_id, queue_id)) as cursor:
+            row = await cursor.fetchone()
+            if not row:
                 return None
+            return row[0], row[1], row[2] or None
     
-    async def get_queue_member_count(self, queue_id: int) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT COUNT(*) FROM queue_members WHERE queue_id = ?",
-                (queue_id,)
-            ) as cursor:
-                return (await cursor.fetchone())[0]
+    async def get_queue_members_with_usernames(self, queue_id: int) -> List[Tuple[int, str]]:
+        async with self._reader().execute(SQL_GET_QUEUE_MEMBER_NAMES, (queue_id,)) as cursor:
+            return await cursor.fetchall()
     
-    async def get_queue_members(self, queue_id: int) -> List[QueueMember]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("""
-                SELECT qm.queue_id, qm.user_id, qm.position, qm.joined_at, u.username, u.surname
-                FROM queue_members qm
-                JOIN users u ON qm.user_id = u.id
-                WHERE qm.queue_id = ?
-                ORDER BY qm.position ASC
-            """, (queue_id,)) as cursor:
-                rows = await cursor.fetchall()
-                return [
-                    QueueMember(
-                        queue_id=row[0],
-                        user_id=row[1],
-                        position=row[2],
-                        joined_at=datetime.fromisoformat(row[3]),
-                        user=User(id=row[1], username=row[4], surname=row[5] or "", created_at=datetime.now())
-                    )
-                    for row in rows
-                ]
+    async def get_queue_top_members(
+        self,
+        queue_id: int,
+        user_id: int,
+        limit: int = 10
+    ) -> Tuple[List[Tuple[int, str]], int, bool]:
+        async with self._reader().execute(SQL_GET_QUEUE_TOP_MEMBERS, (user_id, queue_id, limit)) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            return [], 0, False
+        return [(row[0], row[1]) for row in rows], rows[0][2], bool(rows[0][3])
     
     async def delete_queue(self, queue_id: int, creator_id: int) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT id FROM queues WHERE id = ? AND creator_id = ?",
-                (queue_id, creator_id)
-            ) as cursor:
-                if not await cursor.fetchone():
-                    return False
-            
-            await db.execute(
+        async with self._transaction() as db:
+            cursor = await db.execute(
                 "DELETE FROM queues WHERE id = ? AND creator_id = ?",
                 (queue_id, creator_id)
             )
-            await db.commit()
-            return True
+        return cursor.rowcount > 0
     
     async def remove_user_from_queue(self, queue_id: int, user_id: int, creator_id: int) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT id FROM queues WHERE id = ? AND creator_id = ?",
-                (queue_id, creator_id)
-            ) as cursor:
-                if not await cursor.fetchone():
-                    return False
-            
-            async with db.execute(
-                "SELECT position FROM queue_members WHERE queue_id = ? AND user_id = ?",
-                (queue_id, user_id)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if not row:
-                    return False
-                removed_position = row[0]
-            
-            await db.execute(
-                "DELETE FROM queue_members WHERE queue_id = ? AND user_id = ?",
-                (queue_id, user_id)
-            )
-            
-            await db.execute(
-                "UPDATE queue_members SET position = position - 1 WHERE queue_id = ? AND position > ?",
-                (queue_id, removed_position)
-            )
-            
-            await db.commit()
-            return True
+        async with self._transaction() as db:
+            cursor = await db.execute("""
+                DELETE FROM queue_members
+                WHERE queue_id = ? AND user_id = ?
+                  AND EXISTS (SELECT 1 FROM queues WHERE id = queue_members.queue_id AND creator_id = ?)
+            """, (queue_id, user_id, creator_id))
+        return cursor.rowcount > 0
     
-    async def cleanup_expired_queues(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "DELETE FROM queues WHERE expires_at <= datetime('now')"
-            )
-            await db.commit()
+    async def cleanup_expired_queues(self, batch_size: int = 500) -> Optional[int]:
+        while True:
+            async with self._transaction() as db:
+                cursor = await db.execute("""
+                    DELETE FROM queues WHERE id IN (
+                        SELECT id FROM queues WHERE expires_at <= strftime('%s', 'now') LIMIT ?
+                    )
+                """, (batch_size,))
+                if cursor.rowcount < batch_size:
+                    async with db.execute("SELECT MIN(expires_at) FROM queues") as cursor:
+                        return (await cursor.fetchone())[0]
+            await asyncio.sleep(0)
     
     async def get_queue_with_members(self, queue_id: int) -> Optional[Queue]:
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute(
-                "SELECT id, name, creator_id, created_at, expires_at FROM queues WHERE id = ? AND expires_at > datetime('now')",
-                (queue_id,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    return Queue(
-                        id=row[0],
-                        name=row[1],
-                        creator_id=row[2],
-                        created_at=datetime.fromisoformat(row[3]),
-                        expires_at=datetime.fromisoformat(row[4])
-                    )
-                return None
+        async with self._reader().execute(
+            SQL_GET_QUEUE,
+            (queue_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+            if row:
+                return Queue(
+                    id=row[0],
+                    name=row[1],
+                    creator_id=row[2],
+                    created_at=datetime.fromtimestamp(row[3]),
+                    expires_at=datetime.fromtimestamp(row[4])
+                )
+            return None
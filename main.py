@@ -2,46 +2,200 @@ import asyncio
 import logging
 import os
 import time
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.filters import CommandObject
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ErrorEvent
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+import aiosqlite
 from database import Database
-from models import User, Queue, QueueMember
+from middlewares import RateLimitMiddleware
+from models import User, Queue, QueueMember, UserState, JoinStatus, PopStatus
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+if uvloop:
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в переменных окружения")
 
-bot = Bot(token=BOT_TOKEN)
+DB_PATH = os.getenv('DB_PATH', 'queue_bot.db')
+DB_READERS = int(os.getenv('DB_READERS', '4'))
+
+BROADCAST_CHAT_ID = int(os.getenv('BROADCAST_CHAT_ID') or 0) or None
+
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') or None
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH') or '/webhook'
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST') or '0.0.0.0'
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT') or 8080)
+
+CLEANUP_INTERVAL = 3600
+POLLING_TIMEOUT = 30
+RATE_LIMIT_CACHE_SIZE = 10000
+USER_STATE_CACHE_SIZE = 10000
+USER_STATE_TTL = 600
+API_TIMEOUT = 10
+API_CONNECTION_LIMIT = 100
+API_CONNECTION_LIMIT_PER_HOST = 30
+API_DNS_CACHE_TTL = 300
+API_KEEPALIVE_TIMEOUT = 75
+
+MSG_ERROR = "Произошла ошибка. Попробуй позже."
+MSG_ERROR_ALERT = "❌ Произошла ошибка"
+MSG_CREATE_QUEUE_ERROR = "❌ Произошла ошибка при создании очереди. Попробуй позже."
+MSG_NOT_REGISTERED = "Сначала зарегистрируйся командой /start"
+MSG_NOT_REGISTERED_ALERT = "❌ Сначала зарегистрируйся командой /start"
+MSG_TOO_FREQUENT = "⏳ Слишком часто! Подожди немного."
+MSG_DUPLICATE_CALLBACK = "⚠️ Запрос уже обработан"
+MSG_QUEUE_NOT_FOUND = "Очередь с таким ID не найдена."
+MSG_QUEUE_NOT_FOUND_OR_EXPIRED = "Очередь с таким ID не найдена или истекла."
+MSG_QUEUE_NOT_FOUND_ALERT = "❌ Очередь не найдена"
+MSG_QUEUE_EMPTY_ALERT = "❌ Очередь пуста"
+MSG_ALREADY_IN_QUEUE = "Ты уже в этой очереди!"
+MSG_ALREADY_IN_QUEUE_ALERT = "⚠️ Ты уже в этой очереди!"
+MSG_NOT_IN_QUEUE = "Ты не в этой очереди."
+MSG_NOT_IN_QUEUE_ALERT = "❌ Ты не в этой очереди"
+
+HELP_TEXT = """ℹ️ Помощь по боту
+
+📋 Основные команды:
+/start - регистрация и главное меню
+/create_queue <название> - создать очередь
+/join <queue_id> - встать в очередь
+/next <queue_id> - вызвать следующего (создатель)
+/status <queue_id> - твоя позиция
+/leave <queue_id> - выйти из очереди
+/view_queue <queue_id> - посмотреть очередь
+/delete_queue <queue_id> - удалить очередь (создатель)
+/remove_user <queue_id> <username> - удалить участника (создатель)
+
+👆 Или используй кнопки для удобства!"""
+
+UNKNOWN_MESSAGE_TEXT = """🤔 Не понял, что ты хочешь сделать.
+
+📋 Доступные команды:
+/start - главное меню
+/create_queue <название> - создать очередь
+/join <queue_id> - встать в очередь
+/next <queue_id> - вызвать следующего (создатель)
+/status <queue_id> - твоя позиция
+/leave <queue_id> - выйти из очереди
+/view_queue <queue_id> - посмотреть очередь
+/delete_queue <queue_id> - удалить очередь (создатель)
+/remove_user <queue_id> <username> - удалить участника (создатель)
+
+👆 Или используй /start для доступа к интерактивному меню!"""
+
+
+class RemoveUserCallback(CallbackData, prefix="remove_user"):
+    queue_id: int
+
+
+MAIN_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📋 Создать очередь", callback_data="create_queue")],
+    [InlineKeyboardButton(text="📝 Список очередей", callback_data="list_queues")],
+    [InlineKeyboardButton(text="ℹ️ Помощь", callback_data="help")]
+])
+
+HELP_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📋 Главное меню", callback_data="main_menu")],
+    [InlineKeyboardButton(text="📝 Список очередей", callback_data="list_queues")]
+])
+
+UNKNOWN_MESSAGE_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📋 Главное меню", callback_data="main_menu")],
+    [InlineKeyboardButton(text="ℹ️ Помощь", callback_data="help")]
+])
+
+TO_MAIN_MENU_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="📋 Главное меню", callback_data="main_menu")]
+])
+
+BACK_TO_MAIN_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")]
+])
+
+CANCEL_TO_MAIN_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="❌ Отмена", callback_data="main_menu")]
+])
+
+session = AiohttpSession(timeout=API_TIMEOUT)
+session._connector_init.update(
+    limit=API_CONNECTION_LIMIT,
+    limit_per_host=API_CONNECTION_LIMIT_PER_HOST,
+    ttl_dns_cache=API_DNS_CACHE_TTL,
+    keepalive_timeout=API_KEEPALIVE_TIMEOUT
+)
+bot = Bot(token=BOT_TOKEN, session=session, disable_web_page_preview=True)
+bot.session.middleware(RateLimitMiddleware())
 dp = Dispatcher()
-db = Database()
+db = Database(DB_PATH, readers=DB_READERS)
 
-queue_locks = {}
-user_states = {}
-user_last_action = {}
+user_states = TTLCache(maxsize=USER_STATE_CACHE_SIZE, ttl=USER_STATE_TTL)
+user_last_action = OrderedDict()
 processed_callbacks = set()
+background_tasks = set()
+
+
+def run_in_background(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+def queue_id_arg(handler):
+    @wraps(handler)
+    async def wrapper(message: Message, command: CommandObject):
+        try:
+            queue_id = int((command.args or "").split()[0])
+        except (ValueError, IndexError):
+            await message.answer(f"Укажи корректный ID очереди: /{command.command} <queue_id>")
+            return
+        return await handler(message, queue_id)
+    return wrapper
+
 
+def user_state_is(state: str):
+    def check(message: Message):
+        user_state = user_states.get(message.from_user.id)
+        if user_state is not None and user_state.state == state:
+            return {"user_state": user_state}
+        return False
+    return check
 
-async def get_queue_lock(queue_id: int):
-    if queue_id not in queue_locks:
-        queue_locks[queue_id] = asyncio.Lock()
-    return queue_locks[queue_id]
 
 def check_rate_limit(user_id: int, action: str, limit_seconds: int = 2) -> bool:
     current_time = time.time()
-    key = f"{user_id}_{action}"
+    key = (user_id, action)
     
-    if key in user_last_action:
-        if current_time - user_last_action[key] < limit_seconds:
-            return False
+    last_action = user_last_action.get(key)
+    if last_action is not None and current_time - last_action < limit_seconds:
+        return False
     
     user_last_action[key] = current_time
+    user_last_action.move_to_end(key)
+    if len(user_last_action) > RATE_LIMIT_CACHE_SIZE:
+        user_last_action.popitem(last=False)
     return True
 
 def check_callback_duplicate(callback_id: str) -> bool:
@@ -53,71 +207,124 @@ def check_callback_duplicate(callback_id: str) -> bool:
     return False
 
 
-def create_queue_actions_keyboard(queue_id: int, user_id: int, is_creator: bool = False) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=8192)
+def make_callback_data(prefix: str, queue_id: int) -> str:
+    return f"{prefix}_{queue_id}"
+
+
+@lru_cache(maxsize=4096)
+def create_queue_info_keyboard(queue_id: int, is_member: bool, is_creator: bool) -> InlineKeyboardMarkup:
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[])
+    
+    if not is_member:
+        keyboard.inline_keyboard.append([InlineKeyboardButton(text="✅ Встать в очередь", callback_data=make_callback_data("join", queue_id))])
+    
+    keyboard.inline_keyboard.extend([
+        [InlineKeyboardButton(text="👀 Посмотреть очередь", callback_data=make_callback_data("view_queue", queue_id))],
+        [InlineKeyboardButton(text="⏭️ Вызвать следующего", callback_data=make_callback_data("next", queue_id))]
+    ])
+    
+    if is_member:
+        keyboard.inline_keyboard.extend([
+            [InlineKeyboardButton(text="📊 Мой статус", callback_data=make_callback_data("status", queue_id))],
+            [InlineKeyboardButton(text="🚪 Выйти из очереди", callback_data=make_callback_data("leave", queue_id))]
+        ])
+    
+    if is_creator:
+        keyboard.inline_keyboard.extend([
+            [InlineKeyboardButton(text="👤 Удалить участника", callback_data=RemoveUserCallback(queue_id=queue_id).pack())],
+            [InlineKeyboardButton(text="🗑️ Удалить очередь", callback_data=make_callback_data("delete_queue", queue_id))]
+        ])
+    
+    keyboard.inline_keyboard.append([InlineKeyboardButton(text="🔙 Назад", callback_data="list_queues")])
+    
+    return keyboard
+
+
+@lru_cache(maxsize=1024)
+def create_queue_actions_keyboard(queue_id: int, is_creator: bool = False) -> InlineKeyboardMarkup:
     buttons = [
-        [InlineKeyboardButton(text="👀 Посмотреть очередь", callback_data=f"view_queue_{queue_id}")],
-        [InlineKeyboardButton(text="📊 Мой статус", callback_data=f"status_{queue_id}")],
-        [InlineKeyboardButton(text="🚪 Выйти из очереди", callback_data=f"leave_{queue_id}")],
-        [InlineKeyboardButton(text="⏭️ Вызвать следующего", callback_data=f"next_{queue_id}")]
+        [InlineKeyboardButton(text="👀 Посмотреть очередь", callback_data=make_callback_data("view_queue", queue_id))],
+        [InlineKeyboardButton(text="📊 Мой статус", callback_data=make_callback_data("status", queue_id))],
+        [InlineKeyboardButton(text="🚪 Выйти из очереди", callback_data=make_callback_data("leave", queue_id))],
+        [InlineKeyboardButton(text="⏭️ Вызвать следующего", callback_data=make_callback_data("next", queue_id))]
     ]
     
     if is_creator:
         buttons.extend([
-            [InlineKeyboardButton(text="👤 Удалить участника", callback_data=f"remove_user_{queue_id}")],
-            [InlineKeyboardButton(text="🗑️ Удалить очередь", callback_data=f"delete_queue_{queue_id}")]
+            [InlineKeyboardButton(text="👤 Удалить участника", callback_data=RemoveUserCallback(queue_id=queue_id).pack())],
+            [InlineKeyboardButton(text="🗑️ Удалить очередь", callback_data=make_callback_data("delete_queue", queue_id))]
         ])
     
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def create_join_queue_keyboard(queue_id: int) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=1024)
+def create_broadcast_join_keyboard(bot_username: str, queue_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Встать в очередь", callback_data=f"join_{queue_id}")],
-        [InlineKeyboardButton(text="👀 Посмотреть очередь", callback_data=f"view_queue_{queue_id}")]
+        [InlineKeyboardButton(text="✅ Встать в очередь", url=f"https://t.me/{bot_username}?start=join_{queue_id}")]
     ])
 
 
-def create_main_menu_keyboard() -> InlineKeyboardMarkup:
+@lru_cache(maxsize=4096)
+def create_queue_created_keyboard(queue_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Встать в очередь", callback_data=make_callback_data("join", queue_id))],
+        [InlineKeyboardButton(text="👀 Посмотреть очередь", callback_data=make_callback_data("view_queue", queue_id))],
+        [InlineKeyboardButton(text="📋 Главное меню", callback_data="main_menu")]
+    ])
+
+
+@lru_cache(maxsize=2048)
+def create_member_actions_keyboard(queue_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📊 Мой статус", callback_data=make_callback_data("status", queue_id))],
+        [InlineKeyboardButton(text="👀 Посмотреть очередь", callback_data=make_callback_data("view_queue", queue_id))],
+        [InlineKeyboardButton(text="🚪 Выйти из очереди", callback_data=make_callback_data("leave", queue_id))]
+    ])
+
+
+@lru_cache(maxsize=512)
+def create_back_to_queue_keyboard(queue_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📋 Создать очередь", callback_data="create_queue")],
-        [InlineKeyboardButton(text="📝 Список очередей", callback_data="list_queues")],
-        [InlineKeyboardButton(text="ℹ️ Помощь", callback_data="help")]
+        [InlineKeyboardButton(text="🔙 Назад", callback_data=make_callback_data("queue_info", queue_id))]
     ])
 
 
-async def notify_all_users_about_new_queue(queue_name: str, queue_id: int, exclude_user: int = None):
+def create_main_menu_keyboard() -> InlineKeyboardMarkup:
+    return MAIN_MENU_KB
+
+
+async def edit_callback_message(callback: CallbackQuery, text: str, reply_markup: InlineKeyboardMarkup):
+    message = callback.message
+    if message.text == text and message.reply_markup == reply_markup:
+        return
+    
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in e.message:
+            raise
+
+
+async def announce_new_queue(queue_name: str, queue_id: int):
     try:
-        users = await db.get_all_users()
         notification_text = f"🔔 Новая очередь создана!\n\n📋 {queue_name}\n🆔 ID: {queue_id}\n\n👆 Нажми кнопку, чтобы присоединиться!"
+        bot_user = await bot.me()
+        keyboard = create_broadcast_join_keyboard(bot_user.username, queue_id)
         
-        keyboard = create_join_queue_keyboard(queue_id)
-        
-        for user in users:
-            if exclude_user and user.id == exclude_user:
-                continue
-            
-            try:
-                await bot.send_message(user.id, notification_text, reply_markup=keyboard)
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление пользователю {user.id}: {e}")
-                continue
-    except Exception as e:
-        logger.error(f"Ошибка при отправке уведомлений о новой очереди: {e}")
+        await bot.send_message(BROADCAST_CHAT_ID, notification_text, reply_markup=keyboard)
+    except Exception:
+        logger.exception("Ошибка при публикации новой очереди в канале уведомлений")
 
 
 async def notify_user_about_queue_position(user_id: int, queue_name: str, position: int, total: int, queue_id: int):
     try:
         notification_text = f"📍 Ты добавлен в очередь!\n\n📋 {queue_name}\n🎯 Позиция: {position} из {total}"
         
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📊 Мой статус", callback_data=f"status_{queue_id}")],
-            [InlineKeyboardButton(text="👀 Посмотреть очередь", callback_data=f"view_queue_{queue_id}")],
-            [InlineKeyboardButton(text="🚪 Выйти из очереди", callback_data=f"leave_{queue_id}")]
-        ])
-        
-        await bot.send_message(user_id, notification_text, reply_markup=keyboard)
+        await bot.send_message(user_id, notification_text, reply_markup=create_member_actions_keyboard(queue_id))
     except Exception as e:
-        logger.error(f"Не удалось отправить уведомление о позиции пользователю {user_id}: {e}")
+        logger.error("Не удалось отправить уведомление о позиции пользователю %s: %s", user_id, e)
 
 
 async def notify_user_about_turn(user_id: int, queue_name: str):
@@ -125,12 +332,17 @@ async def notify_user_about_turn(user_id: int, queue_name: str):
         notification_text = f"🎉 Твоя очередь подошла!\n\n📋 {queue_name}\n⏰ Подходи к сдаче лабораторной работы!"
         await bot.send_message(user_id, notification_text)
     except Exception as e:
-        logger.error(f"Не удалось отправить уведомление о вызове пользователю {user_id}: {e}")
-        pass
+        logger.error("Не удалось отправить уведомление о вызове пользователю %s: %s", user_id, e)
+
+
+async def notify_user_about_removal(user_id: int, queue_name: str):
+    try:
+        await bot.send_message(user_id, f"⚠️ Ты был удален из очереди '{queue_name}' администратором.")
+    except Exception as e:
+        logger.error("Не удалось отправить уведомление об удалении пользователю %s: %s", user_id, e)
 
 
-@dp.message(Command("start"))
-async def cmd_start(message: Message):
+async def cmd_start(message: Message, command: CommandObject):
     user_id = message.from_user.id
     username = message.from_user.username or message.from_user.first_name or "Неизвестный"
     
@@ -144,13 +356,17 @@ async def cmd_start(message: Message):
         
         keyboard = create_main_menu_keyboard()
         await message.answer(welcome_text, reply_markup=keyboard)
-    except Exception as e:
-        logger.error(f"Ошибка при регистрации пользователя {user_id}: {e}")
+    except aiosqlite.Error:
+        logger.exception("Ошибка при регистрации пользователя %s", user_id)
         await message.answer("❌ Произошла ошибка при регистрации. Попробуй позже.")
+        return
+    
+    payload = command.args or ""
+    if payload.startswith("join_") and payload.removeprefix("join_").isdigit():
+        await join_queue(message, int(payload.removeprefix("join_")))
 
 
-@dp.message(Command("create_queue"))
-async def cmd_create_queue(message: Message):
+async def cmd_create_queue(message: Message, command: CommandObject):
     if not check_rate_limit(message.from_user.id, "create_queue_command", 10):
         await message.answer("⏳ Слишком часто! Подожди немного перед созданием новой очереди.")
         return
@@ -158,10 +374,10 @@ async def cmd_create_queue(message: Message):
     
     user = await db.get_user(user_id)
     if not user:
-        await message.answer("Сначала зарегистрируйся командой /start")
+        await message.answer(MSG_NOT_REGISTERED)
         return
     
-    queue_name = message.text.replace("/create_queue", "").strip()
+    queue_name = command.args or ""
     if not queue_name:
         await message.answer("Укажи название очереди: /create_queue <название>")
         return
@@ -170,263 +386,149 @@ async def cmd_create_queue(message: Message):
         queue_id = await db.create_queue(queue_name, user_id)
         success_text = f"✅ Очередь '{queue_name}' создана!\n\n🆔 ID очереди: {queue_id}\n⏰ Автоматически удалится через 24 часа\n\n👥 Поделись ID с участниками, чтобы они могли присоединиться!"
         
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="✅ Встать в очередь", callback_data=f"join_{queue_id}")],
-            [InlineKeyboardButton(text="👀 Посмотреть очередь", callback_data=f"view_queue_{queue_id}")],
-            [InlineKeyboardButton(text="📋 Главное меню", callback_data="main_menu")]
-        ])
+        keyboard = create_queue_created_keyboard(queue_id)
         
         await message.answer(success_text, reply_markup=keyboard)
         
-    except Exception as e:
-        logger.error(f"Ошибка при создании очереди: {e}")
-        await message.answer("❌ Произошла ошибка при создании очереди. Попробуй позже.")
+        if BROADCAST_CHAT_ID:
+            run_in_background(announce_new_queue(queue_name, queue_id))
+        
+    except aiosqlite.Error:
+        logger.exception("Ошибка при создании очереди")
+        await message.answer(MSG_CREATE_QUEUE_ERROR)
 
 
-@dp.message(Command("join"))
-async def cmd_join_queue(message: Message):
+async def join_queue(message: Message, queue_id: int):
     user_id = message.from_user.id
     
     user = await db.get_user(user_id)
     if not user:
-        await message.answer("Сначала зарегистрируйся командой /start")
+        await message.answer(MSG_NOT_REGISTERED)
         return
     
-    try:
-        queue_id = int(message.text.replace("/join", "").strip())
-    except ValueError:
-        await message.answer("Укажи корректный ID очереди: /join <queue_id>")
+    result = await db.try_join_queue(queue_id, user_id)
+    if result.status is JoinStatus.QUEUE_NOT_FOUND:
+        await message.answer(MSG_QUEUE_NOT_FOUND)
         return
     
-    lock = await get_queue_lock(queue_id)
-    async with lock:
-        try:
-            queue = await db.get_queue(queue_id)
-            if not queue:
-                await message.answer("Очередь с таким ID не найдена.")
-                return
-            
-            existing_member = await db.get_queue_member(queue_id, user_id)
-            if existing_member:
-                await message.answer("Ты уже в этой очереди!")
-                return
-            
-            position = await db.add_to_queue(queue_id, user_id)
-            total_members = await db.get_queue_member_count(queue_id)
-            
-            updated_text = f"✅ Ты добавлен в очередь '{queue.name}'!\n\n🎯 Позиция: {position} из {total_members}"
-            
-            is_creator = queue.creator_id == user_id
-            keyboard = create_queue_actions_keyboard(queue_id, user_id, is_creator)
-            
-            await message.answer(updated_text, reply_markup=keyboard)
-            
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении в очередь: {e}")
-            await message.answer("Произошла ошибка. Попробуй позже.")
-
-
-@dp.message(Command("next"))
-async def cmd_next(message: Message):
-    if not check_rate_limit(message.from_user.id, "next_command", 3):
-        await message.answer("⏳ Слишком часто! Подожди немного.")
+    if result.status is JoinStatus.ALREADY_MEMBER:
+        await message.answer(MSG_ALREADY_IN_QUEUE)
         return
     
-    user_id = message.from_user.id
+    queue = result.queue
+    updated_text = f"✅ Ты добавлен в очередь '{queue.name}'!\n\n🎯 Позиция: {result.position} из {result.total}"
     
-    try:
-        queue_id = int(message.text.replace("/next", "").strip())
-    except ValueError:
-        await message.answer("Укажи корректный ID очереди: /next <queue_id>")
+    is_creator = queue.creator_id == user_id
+    keyboard = create_queue_actions_keyboard(queue_id, is_creator)
+    
+    await message.answer(updated_text, reply_markup=keyboard)
+
+
+@queue_id_arg
+async def cmd_join_queue(message: Message, queue_id: int):
+    await join_queue(message, queue_id)
+
+
+@queue_id_arg
+async def cmd_next(message: Message, queue_id: int):
+    if not check_rate_limit(message.from_user.id, "next_command", 3):
+        await message.answer(MSG_TOO_FREQUENT)
         return
     
-    lock = await get_queue_lock(queue_id)
-    async with lock:
-        try:
-            queue = await db.get_queue(queue_id)
-            if not queue:
-                await message.answer("Очередь с таким ID не найдена.")
-                return
-            
-            next_member = await db.get_next_in_queue(queue_id)
-            if not next_member:
-                await message.answer("Очередь пуста.")
-                return
-            
-            await db.remove_from_queue(queue_id, next_member.user_id)
-            
-            member_name = f"{next_member.user.surname} @{next_member.user.username}" if next_member.user.surname else f"@{next_member.user.username}"
-            await message.answer(f"✅ Участник {member_name} вызван!")
-            await notify_user_about_turn(next_member.user_id, queue.name)
-            
-        except Exception as e:
-            logger.error(f"Ошибка при вызове следующего: {e}")
-            await message.answer("Произошла ошибка. Попробуй позже.")
-
-
-@dp.message(Command("status"))
-async def cmd_status(message: Message):
-    user_id = message.from_user.id
+    result = await db.pop_next(queue_id)
+    if result.status is PopStatus.QUEUE_NOT_FOUND:
+        await message.answer(MSG_QUEUE_NOT_FOUND)
+        return
     
-    try:
-        queue_id = int(message.text.replace("/status", "").strip())
-    except ValueError:
-        await message.answer("Укажи корректный ID очереди: /status <queue_id>")
+    if result.status is PopStatus.EMPTY:
+        await message.answer("Очередь пуста.")
         return
     
-    try:
-        member = await db.get_queue_member(queue_id, user_id)
-        if not member:
-            await message.answer("Ты не в этой очереди.")
-            return
-        
-        queue = await db.get_queue(queue_id)
-        total_members = await db.get_queue_member_count(queue_id)
-        
-        await message.answer(
-            f"Очередь: {queue.name}\n"
-            f"Твоя позиция: {member.position}\n"
-            f"Всего участников: {total_members}"
-        )
-        
-    except Exception as e:
-        logger.error(f"Ошибка при получении статуса: {e}")
-        await message.answer("Произошла ошибка. Попробуй позже.")
+    next_member = result.member
+    member_name = f"{next_member.user.surname} @{next_member.user.username}" if next_member.user.surname else f"@{next_member.user.username}"
+    await message.answer(f"✅ Участник {member_name} вызван!")
+    run_in_background(notify_user_about_turn(next_member.user_id, result.queue_name))
 
 
-@dp.message(Command("leave"))
-async def cmd_leave_queue(message: Message):
+@queue_id_arg
+async def cmd_status(message: Message, queue_id: int):
     user_id = message.from_user.id
     
-    try:
-        queue_id = int(message.text.replace("/leave", "").strip())
-    except ValueError:
-        await message.answer("Укажи корректный ID очереди: /leave <queue_id>")
+    status = await db.get_status(queue_id, user_id)
+    if not status or status[2] is None:
+        await message.answer(MSG_NOT_IN_QUEUE)
         return
     
-    lock = await get_queue_lock(queue_id)
-    async with lock:
-        try:
-            member = await db.get_queue_member(queue_id, user_id)
-            if not member:
-                await message.answer("Ты не в этой очереди.")
-                return
-            
-            await db.remove_from_queue(queue_id, user_id)
-            await message.answer("✅ Ты покинул очередь.")
-            
-        except Exception as e:
-            logger.error(f"Ошибка при выходе из очереди: {e}")
-            await message.answer("Произошла ошибка. Попробуй позже.")
-
-
-@dp.message(Command("list_queues"))
-async def cmd_list_queues(message: Message):
-    try:
-        queues = await db.get_all_queues()
-        if not queues:
-            await message.answer("Нет активных очередей.")
-            return
-        
-        response = "Доступные очереди:\n\n"
-        for queue in queues:
-            member_count = await db.get_queue_member_count(queue.id)
-            response += f"ID: {queue.id} - {queue.name} ({member_count} участников)\n"
-        
-        await message.answer(response)
-        
-    except Exception as e:
-        logger.error(f"Ошибка при получении списка очередей: {e}")
-        await message.answer("Произошла ошибка. Попробуй позже.")
+    queue_name, total_members, position = status
+    
+    await message.answer(
+        f"Очередь: {queue_name}\n"
+        f"Твоя позиция: {position}\n"
+        f"Всего участников: {total_members}"
+    )
 
 
-@dp.message(Command("help"))
-async def cmd_help(message: Message):
-    help_text = """ℹ️ Помощь по боту
+@queue_id_arg
+async def cmd_leave_queue(message: Message, queue_id: int):
+    user_id = message.from_user.id
+    
+    if not await db.remove_from_queue(queue_id, user_id):
+        await message.answer(MSG_NOT_IN_QUEUE)
+        return
+    
+    await message.answer("✅ Ты покинул очередь.")
 
-📋 Основные команды:
-/start - регистрация и главное меню
-/create_queue <название> - создать очередь
-/join <queue_id> - встать в очередь
-/next <queue_id> - вызвать следующего (создатель)
-/status <queue_id> - твоя позиция
-/leave <queue_id> - выйти из очереди
-/view_queue <queue_id> - посмотреть очередь
-/delete_queue <queue_id> - удалить очередь (создатель)
-/remove_user <queue_id> <username> - удалить участника (создатель)
 
-👆 Или используй кнопки для удобства!"""
+async def cmd_list_queues(message: Message, command: CommandObject):
+    queues = await db.get_all_queues_with_counts()
+    if not queues:
+        await message.answer("Нет активных очередей.")
+        return
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📋 Главное меню", callback_data="main_menu")],
-        [InlineKeyboardButton(text="📝 Список очередей", callback_data="list_queues")]
-    ])
+    response = "Доступные очереди:\n\n" + "\n".join(
+        f"ID: {queue.id} - {queue.name} ({member_count} участников)" for queue, member_count in queues
+    )
     
-    await message.answer(help_text, reply_markup=keyboard)
+    await message.answer(response)
 
 
-@dp.message(Command("view_queue"))
-async def cmd_view_queue(message: Message):
-    try:
-        queue_id = int(message.text.replace("/view_queue", "").strip())
-    except ValueError:
-        await message.answer("Укажи корректный ID очереди: /view_queue <queue_id>")
+async def cmd_help(message: Message, command: CommandObject):
+    await message.answer(HELP_TEXT, reply_markup=HELP_KB)
+
+
+@queue_id_arg
+async def cmd_view_queue(message: Message, queue_id: int):
+    queue = await db.get_queue(queue_id)
+    if not queue:
+        await message.answer(MSG_QUEUE_NOT_FOUND_OR_EXPIRED)
         return
     
-    try:
-        queue = await db.get_queue(queue_id)
-        if not queue:
-            await message.answer("Очередь с таким ID не найдена или истекла.")
-            return
-        
-        members = await db.get_queue_members(queue_id)
-        if not members:
-            await message.answer(f"Очередь '{queue.name}' пуста.")
-            return
-        
-        response = f"Очередь: {queue.name}\n\n"
-        for member in members:
-            if member.user.surname:
-                response += f"{member.position}. {member.user.surname} @{member.user.username}\n"
-            else:
-                response += f"{member.position}. @{member.user.username}\n"
-        
-        await message.answer(response)
-        
-    except Exception as e:
-        logger.error(f"Ошибка при просмотре очереди: {e}")
-        await message.answer("Произошла ошибка. Попробуй позже.")
+    members = await db.get_queue_members_with_usernames(queue_id)
+    if not members:
+        await message.answer(f"Очередь '{queue.name}' пуста.")
+        return
+    
+    response = f"Очередь: {queue.name}\n\n" + "\n".join(f"{position}. {name}" for position, name in members)
+    
+    await message.answer(response)
 
 
-@dp.message(Command("delete_queue"))
-async def cmd_delete_queue(message: Message):
+@queue_id_arg
+async def cmd_delete_queue(message: Message, queue_id: int):
     user_id = message.from_user.id
     
-    try:
-        queue_id = int(message.text.replace("/delete_queue", "").strip())
-    except ValueError:
-        await message.answer("Укажи корректный ID очереди: /delete_queue <queue_id>")
-        return
-    
-    lock = await get_queue_lock(queue_id)
-    async with lock:
-        try:
-            success = await db.delete_queue(queue_id, user_id)
-            if success:
-                await message.answer("Очередь удалена.")
-            else:
-                await message.answer("Очередь не найдена или ты не являешься её создателем.")
-        except Exception as e:
-            logger.error(f"Ошибка при удалении очереди: {e}")
-            await message.answer("Произошла ошибка. Попробуй позже.")
-
-
-@dp.message(Command("remove_user"))
-async def cmd_remove_user(message: Message):
+    success = await db.delete_queue(queue_id, user_id)
+    if success:
+        await message.answer("Очередь удалена.")
+    else:
+        await message.answer("Очередь не найдена или ты не являешься её создателем.")
+
+
+async def cmd_remove_user(message: Message, command: CommandObject):
     user_id = message.from_user.id
     
     try:
-        parts = message.text.replace("/remove_user", "").strip().split()
+        parts = (command.args or "").split()
         if len(parts) != 2:
             await message.answer("Формат: /remove_user <queue_id> <username>")
             return
@@ -437,557 +539,468 @@ async def cmd_remove_user(message: Message):
         await message.answer("Укажи корректные данные: /remove_user <queue_id> <username>")
         return
     
-    lock = await get_queue_lock(queue_id)
-    async with lock:
-        try:
-            queue = await db.get_queue(queue_id)
-            if not queue:
-                await message.answer("Очередь с таким ID не найдена или истекла.")
-                return
-            
-            if queue.creator_id != user_id:
-                await message.answer("Только создатель очереди может удалять участников.")
-                return
-            
-            target_user = await db.get_user_by_username(target_username)
-            if not target_user:
-                await message.answer(f"Пользователь с именем '{target_username}' не найден.")
-                return
-            
-            success = await db.remove_user_from_queue(queue_id, target_user.id, user_id)
-            if success:
-                await message.answer(f"Пользователь {target_username} удален из очереди.")
-                
-                try:
-                    await bot.send_message(
-                        target_user.id,
-                        f"⚠️ Ты был удален из очереди '{queue.name}' администратором."
-                    )
-                except:
-                    pass
-            else:
-                await message.answer("Пользователь не найден в очереди.")
-        except Exception as e:
-            logger.error(f"Ошибка при удалении пользователя: {e}")
-            await message.answer("Произошла ошибка. Попробуй позже.")
+    queue = await db.get_queue(queue_id)
+    if not queue:
+        await message.answer(MSG_QUEUE_NOT_FOUND_OR_EXPIRED)
+        return
+    
+    if queue.creator_id != user_id:
+        await message.answer("Только создатель очереди может удалять участников.")
+        return
+    
+    target_user = await db.get_user_by_username(target_username)
+    if not target_user:
+        await message.answer(f"Пользователь с именем '{target_username}' не найден.")
+        return
+    
+    success = await db.remove_user_from_queue(queue_id, target_user.id, user_id)
+    if success:
+        run_in_background(notify_user_about_removal(target_user.id, queue.name))
+        await message.answer(f"Пользователь {target_username} удален из очереди.")
+    else:
+        await message.answer("Пользователь не найден в очереди.")
+
+
+COMMAND_HANDLERS = {
+    "start": cmd_start,
+    "create_queue": cmd_create_queue,
+    "join": cmd_join_queue,
+    "next": cmd_next,
+    "status": cmd_status,
+    "leave": cmd_leave_queue,
+    "list_queues": cmd_list_queues,
+    "help": cmd_help,
+    "view_queue": cmd_view_queue,
+    "delete_queue": cmd_delete_queue,
+    "remove_user": cmd_remove_user,
+}
+
+
+@dp.message(F.text.startswith("/"))
+async def dispatch_command(message: Message):
+    head, *args = message.text.split(maxsplit=1)
+    command, _, mention = head[1:].partition("@")
+    handler = COMMAND_HANDLERS.get(command)
+    if not handler:
+        raise SkipHandler()
+    
+    if mention and mention.lower() != (await bot.me()).username.lower():
+        raise SkipHandler()
+    
+    await handler(message, CommandObject(command=command, mention=mention or None, args=args[0] if args else None))
 
 
 @dp.callback_query(F.data == "main_menu")
 async def callback_main_menu(callback: CallbackQuery):
     user_id = callback.from_user.id
-    if user_id in user_states:
-        del user_states[user_id]
+    user_states.pop(user_id, None)
     
-    await callback.message.edit_text(
-        "📋 Главное меню\n\nВыбери действие:",
-        reply_markup=create_main_menu_keyboard()
-    )
+    await edit_callback_message(callback, "📋 Главное меню\n\nВыбери действие:", create_main_menu_keyboard())
     await callback.answer()
 
 
 @dp.callback_query(F.data == "list_queues")
 async def callback_list_queues(callback: CallbackQuery):
-    try:
-        queues = await db.get_all_queues()
-        if not queues:
-            await callback.message.edit_text(
-                "📝 Нет активных очередей",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")]
-                ])
-            )
-            return
-        
-        response = "📝 Доступные очереди:\n\n"
-        keyboard_buttons = []
-        user_id = callback.from_user.id
-        
-        for queue in queues:
-            member_count = await db.get_queue_member_count(queue.id)
-            response += f"🆔 {queue.id} - {queue.name} ({member_count} участников)\n"
-            
-            is_member = await db.get_queue_member(queue.id, user_id) is not None
-            
-            if is_member:
-                button_text = f"📋 {queue.name} (ты в очереди)"
-            else:
-                button_text = f"📋 {queue.name}"
-            
-            keyboard_buttons.append([InlineKeyboardButton(
-                text=button_text,
-                callback_data=f"queue_info_{queue.id}"
-            )])
-        
-        keyboard_buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")])
-        
-        await callback.message.edit_text(
-            response,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-        )
+    user_id = callback.from_user.id
+    queues = await db.get_queues_with_counts_and_membership(user_id)
+    if not queues:
+        await edit_callback_message(callback, "📝 Нет активных очередей", BACK_TO_MAIN_KB)
         await callback.answer()
+        return
+    
+    lines = []
+    keyboard_buttons = []
+    
+    for queue, member_count, is_member in queues:
+        lines.append(f"🆔 {queue.id} - {queue.name} ({member_count} участников)")
         
-    except Exception as e:
-        logger.error(f"Ошибка при получении списка очередей: {e}")
-        await callback.answer("❌ Произошла ошибка", show_alert=True)
+        if is_member:
+            button_text = f"📋 {queue.name} (ты в очереди)"
+        else:
+            button_text = f"📋 {queue.name}"
+        
+        keyboard_buttons.append([InlineKeyboardButton(
+            text=button_text,
+            callback_data=make_callback_data("queue_info", queue.id)
+        )])
+    
+    keyboard_buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")])
+    
+    response = "📝 Доступные очереди:\n\n" + "\n".join(lines)
+    
+    await edit_callback_message(callback, response, InlineKeyboardMarkup(inline_keyboard=keyboard_buttons))
+    await callback.answer()
 
 
 @dp.callback_query(F.data.startswith("queue_info_"))
 async def callback_queue_info(callback: CallbackQuery):
-    try:
-        queue_id = int(callback.data.split("_")[2])
-        queue = await db.get_queue(queue_id)
-        
-        if not queue:
-            await callback.answer("❌ Очередь не найдена", show_alert=True)
-            return
-        
-        members = await db.get_queue_members(queue_id)
-        is_creator = queue.creator_id == callback.from_user.id
-        user_id = callback.from_user.id
-        is_member = any(member.user_id == user_id for member in members)
-        
-        response = f"📋 {queue.name}\n🆔 ID: {queue.id}\n👥 Участников: {len(members)}\n"
-        
-        if members:
-            response += "\n👥 Участники:\n"
-            for member in members[:10]:
-                if member.user.surname:
-                    response += f"{member.position}. {member.user.surname} @{member.user.username}\n"
-                else:
-                    response += f"{member.position}. @{member.user.username}\n"
-            if len(members) > 10:
-                response += f"... и еще {len(members) - 10} участников"
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[])
-        
-        if not is_member:
-            keyboard.inline_keyboard.append([InlineKeyboardButton(text="✅ Встать в очередь", callback_data=f"join_{queue_id}")])
-        
-        keyboard.inline_keyboard.extend([
-            [InlineKeyboardButton(text="👀 Посмотреть очередь", callback_data=f"view_queue_{queue_id}")],
-            [InlineKeyboardButton(text="⏭️ Вызвать следующего", callback_data=f"next_{queue_id}")]
-        ])
-        
-        if is_member:
-            keyboard.inline_keyboard.extend([
-                [InlineKeyboardButton(text="📊 Мой статус", callback_data=f"status_{queue_id}")],
-                [InlineKeyboardButton(text="🚪 Выйти из очереди", callback_data=f"leave_{queue_id}")]
-            ])
-        
-        if is_creator:
-            keyboard.inline_keyboard.extend([
-                [InlineKeyboardButton(text="👤 Удалить участника", callback_data=f"remove_user_{queue_id}")],
-                [InlineKeyboardButton(text="🗑️ Удалить очередь", callback_data=f"delete_queue_{queue_id}")]
-            ])
-        
-        keyboard.inline_keyboard.append([InlineKeyboardButton(text="🔙 Назад", callback_data="list_queues")])
-        
-        await callback.message.edit_text(response, reply_markup=keyboard)
-        await callback.answer()
-        
-    except Exception as e:
-        logger.error(f"Ошибка при получении информации об очереди: {e}")
-        await callback.answer("❌ Произошла ошибка", show_alert=True)
+    queue_id = int(callback.data.removeprefix("queue_info_"))
+    queue = await db.get_queue(queue_id)
+    
+    if not queue:
+        await callback.answer(MSG_QUEUE_NOT_FOUND_ALERT, show_alert=True)
+        return
+    
+    user_id = callback.from_user.id
+    is_creator = queue.creator_id == user_id
+    members, total, is_member = await db.get_queue_top_members(queue_id, user_id)
+    
+    response = f"📋 {queue.name}\n🆔 ID: {queue.id}\n👥 Участников: {total}\n"
+    
+    if members:
+        lines = [f"{position}. {name}" for position, name in members]
+        if total > len(members):
+            lines.append(f"... и еще {total - len(members)} участников")
+        response += "\n👥 Участники:\n" + "\n".join(lines)
+    
+    keyboard = create_queue_info_keyboard(queue_id, is_member, is_creator)
+    
+    await edit_callback_message(callback, response, keyboard)
+    await callback.answer()
 
 
 @dp.callback_query(F.data.startswith("join_"))
 async def callback_join_queue(callback: CallbackQuery):
     if check_callback_duplicate(f"{callback.from_user.id}_{callback.data}_{callback.message.message_id}"):
-        await callback.answer("⚠️ Запрос уже обработан", show_alert=True)
+        await callback.answer(MSG_DUPLICATE_CALLBACK, show_alert=True)
         return
     
     if not check_rate_limit(callback.from_user.id, "join_button", 2):
-        await callback.answer("⏳ Слишком часто! Подожди немного.", show_alert=True)
+        await callback.answer(MSG_TOO_FREQUENT, show_alert=True)
         return
-    queue_id = int(callback.data.split("_")[1])
+    queue_id = int(callback.data.removeprefix("join_"))
     user_id = callback.from_user.id
     
     user = await db.get_user(user_id)
     if not user:
-        await callback.answer("❌ Сначала зарегистрируйся командой /start", show_alert=True)
+        await callback.answer(MSG_NOT_REGISTERED_ALERT, show_alert=True)
         return
     
-    lock = await get_queue_lock(queue_id)
-    async with lock:
-        try:
-            queue = await db.get_queue(queue_id)
-            if not queue:
-                await callback.answer("❌ Очередь не найдена", show_alert=True)
-                return
-            
-            existing_member = await db.get_queue_member(queue_id, user_id)
-            if existing_member:
-                await callback.answer("⚠️ Ты уже в этой очереди!", show_alert=True)
-                return
-            
-            if not user.surname:
-                user_states[user_id] = {
-                    "state": "waiting_surname",
-                    "queue_id": queue_id,
-                    "join_message_id": callback.message.message_id
-                }
-                
-                await callback.message.edit_text(
-                    f"👤 Введите вашу фамилию для очереди '{queue.name}':",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="❌ Отмена", callback_data=f"queue_info_{queue_id}")]
-                    ])
-                )
-                await callback.answer()
-                return
-            
-            position = await db.add_to_queue(queue_id, user_id)
-            total_members = await db.get_queue_member_count(queue_id)
-            
-            updated_text = f"✅ Ты добавлен в очередь '{queue.name}'!\n\n🎯 Позиция: {position} из {total_members}"
-            
-            is_creator = queue.creator_id == user_id
-            keyboard = create_queue_actions_keyboard(queue_id, user_id, is_creator)
-            
-            await callback.message.edit_text(updated_text, reply_markup=keyboard)
-            await callback.answer(f"✅ Ты добавлен в очередь на позицию {position}!")
-            
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении в очередь: {e}")
-            await callback.answer("❌ Произошла ошибка", show_alert=True)
+    if not user.surname:
+        queue = await db.get_queue(queue_id)
+        if not queue:
+            await callback.answer(MSG_QUEUE_NOT_FOUND_ALERT, show_alert=True)
+            return
+        
+        if await db.get_queue_member(queue_id, user_id):
+            await callback.answer(MSG_ALREADY_IN_QUEUE_ALERT, show_alert=True)
+            return
+        
+        user_states[user_id] = UserState("waiting_surname", callback.message.chat.id, callback.message.message_id, queue_id)
+        
+        await callback.message.edit_text(
+            f"👤 Введите вашу фамилию для очереди '{queue.name}':",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="❌ Отмена", callback_data=make_callback_data("queue_info", queue_id))]
+            ])
+        )
+        await callback.answer()
+        return
+    
+    result = await db.try_join_queue(queue_id, user_id)
+    if result.status is JoinStatus.QUEUE_NOT_FOUND:
+        await callback.answer(MSG_QUEUE_NOT_FOUND_ALERT, show_alert=True)
+        return
+    
+    if result.status is JoinStatus.ALREADY_MEMBER:
+        await callback.answer(MSG_ALREADY_IN_QUEUE_ALERT, show_alert=True)
+        return
+    
+    queue = result.queue
+    updated_text = f"✅ Ты добавлен в очередь '{queue.name}'!\n\n🎯 Позиция: {result.position} из {result.total}"
+    
+    is_creator = queue.creator_id == user_id
+    keyboard = create_queue_actions_keyboard(queue_id, is_creator)
+    
+    await callback.message.edit_text(updated_text, reply_markup=keyboard)
+    await callback.answer(f"✅ Ты добавлен в очередь на позицию {result.position}!")
 
 
 @dp.callback_query(F.data.startswith("leave_"))
 async def callback_leave_queue(callback: CallbackQuery):
     if not check_rate_limit(callback.from_user.id, "leave_button", 2):
-        await callback.answer("⏳ Слишком часто! Подожди немного.", show_alert=True)
+        await callback.answer(MSG_TOO_FREQUENT, show_alert=True)
         return
-    queue_id = int(callback.data.split("_")[1])
+    queue_id = int(callback.data.removeprefix("leave_"))
     user_id = callback.from_user.id
     
-    lock = await get_queue_lock(queue_id)
-    async with lock:
-        try:
-            member = await db.get_queue_member(queue_id, user_id)
-            if not member:
-                await callback.answer("❌ Ты не в этой очереди", show_alert=True)
-                return
-            
-            await db.remove_from_queue(queue_id, user_id)
-            await callback.answer("✅ Ты покинул очередь!")
-            
-        except Exception as e:
-            logger.error(f"Ошибка при выходе из очереди: {e}")
-            await callback.answer("❌ Произошла ошибка", show_alert=True)
+    if not await db.remove_from_queue(queue_id, user_id):
+        await callback.answer(MSG_NOT_IN_QUEUE_ALERT, show_alert=True)
+        return
+    
+    await callback.answer("✅ Ты покинул очередь!")
 
 
 @dp.callback_query(F.data.startswith("next_"))
 async def callback_next_user(callback: CallbackQuery):
     if check_callback_duplicate(f"{callback.from_user.id}_{callback.data}_{callback.message.message_id}"):
-        await callback.answer("⚠️ Запрос уже обработан", show_alert=True)
+        await callback.answer(MSG_DUPLICATE_CALLBACK, show_alert=True)
         return
     
     if not check_rate_limit(callback.from_user.id, "next_button", 3):
-        await callback.answer("⏳ Слишком часто! Подожди немного.", show_alert=True)
+        await callback.answer(MSG_TOO_FREQUENT, show_alert=True)
         return
     
-    queue_id = int(callback.data.split("_")[1])
-    user_id = callback.from_user.id
+    queue_id = int(callback.data.removeprefix("next_"))
     
-    lock = await get_queue_lock(queue_id)
-    async with lock:
-        try:
-            queue = await db.get_queue(queue_id)
-            if not queue:
-                await callback.answer("❌ Очередь не найдена", show_alert=True)
-                return
-            
-            next_member = await db.get_next_in_queue(queue_id)
-            if not next_member:
-                await callback.answer("❌ Очередь пуста", show_alert=True)
-                return
-            
-            await db.remove_from_queue(queue_id, next_member.user_id)
-            
-            member_name = f"{next_member.user.surname} @{next_member.user.username}" if next_member.user.surname else f"@{next_member.user.username}"
-            await callback.answer(f"✅ Участник {member_name} вызван!")
-            await notify_user_about_turn(next_member.user_id, queue.name)
-            
-        except Exception as e:
-            logger.error(f"Ошибка при вызове следующего: {e}")
-            await callback.answer("❌ Произошла ошибка", show_alert=True)
+    result = await db.pop_next(queue_id)
+    if result.status is PopStatus.QUEUE_NOT_FOUND:
+        await callback.answer(MSG_QUEUE_NOT_FOUND_ALERT, show_alert=True)
+        return
+    
+    if result.status is PopStatus.EMPTY:
+        await callback.answer(MSG_QUEUE_EMPTY_ALERT, show_alert=True)
+        return
+    
+    next_member = result.member
+    member_name = f"{next_member.user.surname} @{next_member.user.username}" if next_member.user.surname else f"@{next_member.user.username}"
+    await callback.answer(f"✅ Участник {member_name} вызван!")
+    run_in_background(notify_user_about_turn(next_member.user_id, result.queue_name))
 
 
 @dp.callback_query(F.data.startswith("view_queue_"))
 async def callback_view_queue(callback: CallbackQuery):
-    queue_id = int(callback.data.split("_")[2])
+    queue_id = int(callback.data.removeprefix("view_queue_"))
     
-    try:
-        queue = await db.get_queue(queue_id)
-        if not queue:
-            await callback.answer("❌ Очередь не найдена", show_alert=True)
-            return
-        
-        members = await db.get_queue_members(queue_id)
-        if not members:
-            await callback.answer("❌ Очередь пуста", show_alert=True)
-            return
-        
-        response = f"📋 {queue.name}\n\n"
-        for member in members:
-            if member.user.surname:
-                response += f"{member.position}. {member.user.surname} @{member.user.username}\n"
-            else:
-                response += f"{member.position}. @{member.user.username}\n"
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Назад", callback_data=f"queue_info_{queue_id}")]
-        ])
-        
-        await callback.message.edit_text(response, reply_markup=keyboard)
-        await callback.answer()
-        
-    except Exception as e:
-        logger.error(f"Ошибка при просмотре очереди: {e}")
-        await callback.answer("❌ Произошла ошибка", show_alert=True)
+    queue = await db.get_queue(queue_id)
+    if not queue:
+        await callback.answer(MSG_QUEUE_NOT_FOUND_ALERT, show_alert=True)
+        return
+    
+    members = await db.get_queue_members_with_usernames(queue_id)
+    if not members:
+        await callback.answer(MSG_QUEUE_EMPTY_ALERT, show_alert=True)
+        return
+    
+    response = f"📋 {queue.name}\n\n" + "\n".join(f"{position}. {name}" for position, name in members)
+    
+    keyboard = create_back_to_queue_keyboard(queue_id)
+    
+    await edit_callback_message(callback, response, keyboard)
+    await callback.answer()
 
 
 @dp.callback_query(F.data.startswith("status_"))
 async def callback_status(callback: CallbackQuery):
-    queue_id = int(callback.data.split("_")[1])
+    queue_id = int(callback.data.removeprefix("status_"))
     user_id = callback.from_user.id
     
-    try:
-        member = await db.get_queue_member(queue_id, user_id)
-        if not member:
-            await callback.answer("❌ Ты не в этой очереди", show_alert=True)
-            return
-        
-        queue = await db.get_queue(queue_id)
-        total_members = await db.get_queue_member_count(queue_id)
-        
-        response = f"📊 Твой статус в очереди:\n\n📋 {queue.name}\n🎯 Позиция: {member.position}\n👥 Всего участников: {total_members}"
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Назад", callback_data=f"queue_info_{queue_id}")]
-        ])
-        
-        await callback.message.edit_text(response, reply_markup=keyboard)
-        await callback.answer()
-        
-    except Exception as e:
-        logger.error(f"Ошибка при получении статуса: {e}")
-        await callback.answer("❌ Произошла ошибка", show_alert=True)
+    status = await db.get_status(queue_id, user_id)
+    if not status or status[2] is None:
+        await callback.answer(MSG_NOT_IN_QUEUE_ALERT, show_alert=True)
+        return
+    
+    queue_name, total_members, position = status
+    
+    response = f"📊 Твой статус в очереди:\n\n📋 {queue_name}\n🎯 Позиция: {position}\n👥 Всего участников: {total_members}"
+    
+    keyboard = create_back_to_queue_keyboard(queue_id)
+    
+    await edit_callback_message(callback, response, keyboard)
+    await callback.answer()
 
 
 @dp.callback_query(F.data == "help")
 async def callback_help(callback: CallbackQuery):
-    help_text = """ℹ️ Помощь по боту
-
-📋 Основные команды:
-/start - регистрация и главное меню
-/create_queue <название> - создать очередь
-/join <queue_id> - встать в очередь
-/next <queue_id> - вызвать следующего (создатель)
-/status <queue_id> - твоя позиция
-/leave <queue_id> - выйти из очереди
-/view_queue <queue_id> - посмотреть очередь
-/delete_queue <queue_id> - удалить очередь (создатель)
-/remove_user <queue_id> <username> - удалить участника (создатель)
-
-👆 Или используй кнопки для удобства!"""
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="main_menu")]
-    ])
-    
-    await callback.message.edit_text(help_text, reply_markup=keyboard)
+    await edit_callback_message(callback, HELP_TEXT, BACK_TO_MAIN_KB)
     await callback.answer()
 
 
 @dp.callback_query(F.data == "create_queue")
 async def callback_create_queue(callback: CallbackQuery):
     user_id = callback.from_user.id
-    user_states[user_id] = {
-        "state": "waiting_queue_name",
-        "instruction_message_id": callback.message.message_id
-    }
+    
+    user = await db.get_user(user_id)
+    if not user:
+        await callback.answer(MSG_NOT_REGISTERED_ALERT, show_alert=True)
+        return
+    
+    user_states[user_id] = UserState("waiting_queue_name", callback.message.chat.id, callback.message.message_id)
     
     await callback.message.edit_text(
         "📋 Создание новой очереди\n\n✍️ Отправь название очереди текстом (без команд):\n\nНапример: Лабораторная по программированию",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="main_menu")]
-        ])
+        reply_markup=CANCEL_TO_MAIN_KB
     )
     await callback.answer()
 
 
 @dp.callback_query(F.data.startswith("delete_queue_"))
 async def callback_delete_queue(callback: CallbackQuery):
-    queue_id = int(callback.data.split("_")[2])
+    queue_id = int(callback.data.removeprefix("delete_queue_"))
     user_id = callback.from_user.id
     
-    lock = await get_queue_lock(queue_id)
-    async with lock:
-        try:
-            success = await db.delete_queue(queue_id, user_id)
-            if success:
-                await callback.message.edit_text(
-                    "✅ Очередь удалена!",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="📋 Главное меню", callback_data="main_menu")]
-                    ])
-                )
-            else:
-                await callback.answer("❌ Очередь не найдена или ты не являешься её создателем", show_alert=True)
-        except Exception as e:
-            logger.error(f"Ошибка при удалении очереди: {e}")
-            await callback.answer("❌ Произошла ошибка", show_alert=True)
+    success = await db.delete_queue(queue_id, user_id)
+    if success:
+        await callback.message.edit_text(
+            "✅ Очередь удалена!",
+            reply_markup=TO_MAIN_MENU_KB
+        )
+    else:
+        await callback.answer("❌ Очередь не найдена или ты не являешься её создателем", show_alert=True)
     
     await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("remove_user_"))
-async def callback_remove_user(callback: CallbackQuery):
-    queue_id = int(callback.data.split("_")[2])
+@dp.callback_query(RemoveUserCallback.filter())
+async def callback_remove_user(callback: CallbackQuery, callback_data: RemoveUserCallback):
+    queue_id = callback_data.queue_id
     user_id = callback.from_user.id
     
     await callback.message.edit_text(
         f"👤 Удаление участника из очереди\n\nОтправь команду:\n/remove_user {queue_id} <username>\n\nГде <username> - имя пользователя, которого нужно удалить.",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Назад", callback_data=f"queue_info_{queue_id}")]
-        ])
+        reply_markup=create_back_to_queue_keyboard(queue_id)
     )
     await callback.answer()
 
 
-@dp.message()
-async def handle_unknown_message(message: Message):
+@dp.message(F.text, user_state_is("waiting_surname"))
+async def handle_surname(message: Message, user_state: UserState):
     user_id = message.from_user.id
     
-    if user_id in user_states:
-        state = user_states[user_id].get("state")
+    surname = message.text.strip()
+    if not surname:
+        await message.answer("❌ Фамилия не может быть пустой. Попробуй еще раз:")
+        return
+    
+    if len(surname) > 50:
+        await message.answer("❌ Фамилия слишком длинная (максимум 50 символов). Попробуй еще раз:")
+        return
+    
+    user_states.pop(user_id, None)
+    
+    try:
+        queue_id = user_state.queue_id
         
-        if state == "waiting_surname":
-            surname = message.text.strip()
-            if not surname:
-                await message.answer("❌ Фамилия не может быть пустой. Попробуй еще раз:")
-                return
-            
-            if len(surname) > 50:
-                await message.answer("❌ Фамилия слишком длинная (максимум 50 символов). Попробуй еще раз:")
-                return
-            
-            try:
-                queue_id = user_states[user_id]["queue_id"]
-                join_message_id = user_states[user_id]["join_message_id"]
-                
-                await db.update_user_surname(user_id, surname)
-                
-                try:
-                    await bot.delete_message(user_id, join_message_id)
-                except:
-                    pass
-                
-                del user_states[user_id]
-                
-                user = await db.get_user(user_id)
-                position = await db.add_to_queue(queue_id, user_id)
-                total_members = await db.get_queue_member_count(queue_id)
-                queue = await db.get_queue(queue_id)
-                
-                success_text = f"✅ Ты добавлен в очередь '{queue.name}'!\n\n🎯 Позиция: {position} из {total_members}"
-                
-                is_creator = queue.creator_id == user_id
-                keyboard = create_queue_actions_keyboard(queue_id, user_id, is_creator)
-                
-                await message.delete()
-                await message.answer(success_text, reply_markup=keyboard)
-                
-            except Exception as e:
-                logger.error(f"Ошибка при добавлении в очередь: {e}")
-                await message.answer("❌ Произошла ошибка при добавлении в очередь. Попробуй позже.")
-                if user_id in user_states:
-                    del user_states[user_id]
-            return
+        await db.update_user_surname(user_id, surname)
         
-        elif state == "waiting_queue_name":
-            queue_name = message.text.strip()
-            if not queue_name:
-                await message.answer("❌ Название очереди не может быть пустым. Попробуй еще раз:")
-                return
+        try:
+            await bot.delete_message(user_state.chat_id, user_state.message_id)
+        except TelegramAPIError:
+            pass
         
-            if len(queue_name) > 100:
-                await message.answer("❌ Название очереди слишком длинное (максимум 100 символов). Попробуй еще раз:")
-                return
-            
-            try:
-                queue_id = await db.create_queue(queue_name, user_id)
-                
-                instruction_message_id = user_states[user_id].get("instruction_message_id")
-                if instruction_message_id:
-                    try:
-                        await bot.delete_message(user_id, instruction_message_id)
-                    except:
-                        pass
-                
-                del user_states[user_id]
-                
-                success_text = f"✅ Очередь '{queue_name}' создана!\n\n🆔 ID очереди: {queue_id}\n⏰ Автоматически удалится через 24 часа\n\n👥 Поделись ID с участниками, чтобы они могли присоединиться!"
-                
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="✅ Встать в очередь", callback_data=f"join_{queue_id}")],
-                    [InlineKeyboardButton(text="👀 Посмотреть очередь", callback_data=f"view_queue_{queue_id}")],
-                    [InlineKeyboardButton(text="📋 Главное меню", callback_data="main_menu")]
-                ])
-                
-                await message.delete()
-                await message.answer(success_text, reply_markup=keyboard)
-                
-            except Exception as e:
-                logger.error(f"Ошибка при создании очереди: {e}")
-                await message.answer("❌ Произошла ошибка при создании очереди. Попробуй позже.")
-                if user_id in user_states:
-                    del user_states[user_id]
+        result = await db.try_join_queue(queue_id, user_id)
+        if result.status is JoinStatus.QUEUE_NOT_FOUND:
+            await message.answer(MSG_QUEUE_NOT_FOUND)
             return
-    
-    help_text = """🤔 Не понял, что ты хочешь сделать.
+        
+        if result.status is JoinStatus.ALREADY_MEMBER:
+            await message.answer(MSG_ALREADY_IN_QUEUE_ALERT)
+            return
+        
+        queue = result.queue
+        success_text = f"✅ Ты добавлен в очередь '{queue.name}'!\n\n🎯 Позиция: {result.position} из {result.total}"
+        
+        is_creator = queue.creator_id == user_id
+        keyboard = create_queue_actions_keyboard(queue_id, is_creator)
+        
+        await message.delete()
+        await message.answer(success_text, reply_markup=keyboard)
+        
+    except aiosqlite.Error:
+        logger.exception("Ошибка при добавлении в очередь")
+        await message.answer("❌ Произошла ошибка при добавлении в очередь. Попробуй позже.")
 
-📋 Доступные команды:
-/start - главное меню
-/create_queue <название> - создать очередь
-/join <queue_id> - встать в очередь
-/next <queue_id> - вызвать следующего (создатель)
-/status <queue_id> - твоя позиция
-/leave <queue_id> - выйти из очереди
-/view_queue <queue_id> - посмотреть очередь
-/delete_queue <queue_id> - удалить очередь (создатель)
-/remove_user <queue_id> <username> - удалить участника (создатель)
 
-👆 Или используй /start для доступа к интерактивному меню!"""
+@dp.message(F.text, user_state_is("waiting_queue_name"))
+async def handle_queue_name(message: Message, user_state: UserState):
+    user_id = message.from_user.id
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📋 Главное меню", callback_data="main_menu")],
-        [InlineKeyboardButton(text="ℹ️ Помощь", callback_data="help")]
-    ])
+    queue_name = message.text.strip()
+    if not queue_name:
+        await message.answer("❌ Название очереди не может быть пустым. Попробуй еще раз:")
+        return
+    
+    if len(queue_name) > 100:
+        await message.answer("❌ Название очереди слишком длинное (максимум 100 символов). Попробуй еще раз:")
+        return
     
-    await message.answer(help_text, reply_markup=keyboard)
+    user_states.pop(user_id, None)
+    
+    user = await db.get_user(user_id)
+    if not user:
+        await message.answer(MSG_NOT_REGISTERED)
+        return
+    
+    try:
+        queue_id = await db.create_queue(queue_name, user_id)
+        
+        success_text = f"✅ Очередь '{queue_name}' создана!\n\n🆔 ID очереди: {queue_id}\n⏰ Автоматически удалится через 24 часа\n\n👥 Поделись ID с участниками, чтобы они могли присоединиться!"
+        
+        keyboard = create_queue_created_keyboard(queue_id)
+        
+        results = await asyncio.gather(
+            bot.delete_message(user_state.chat_id, user_state.message_id),
+            bot.delete_message(message.chat.id, message.message_id),
+            bot.send_message(message.chat.id, success_text, reply_markup=keyboard),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("Не удалось обновить сообщения после создания очереди: %s", result)
+        
+        if BROADCAST_CHAT_ID:
+            run_in_background(announce_new_queue(queue_name, queue_id))
+        
+    except aiosqlite.Error:
+        logger.exception("Ошибка при создании очереди")
+        await message.answer(MSG_CREATE_QUEUE_ERROR)
+
+
+@dp.message()
+async def handle_unknown_message(message: Message):
+    await message.answer(UNKNOWN_MESSAGE_TEXT, reply_markup=UNKNOWN_MESSAGE_KB)
+
+
+@dp.error()
+async def error_handler(event: ErrorEvent):
+    logger.error("Ошибка при обработке обновления %s", event.update.update_id, exc_info=event.exception)
+    if event.update.callback_query:
+        await event.update.callback_query.answer(MSG_ERROR_ALERT, show_alert=True)
+    elif event.update.message:
+        await event.update.message.answer(MSG_ERROR)
 
 
 async def cleanup_task():
     while True:
+        delay = CLEANUP_INTERVAL
         try:
-            await db.cleanup_expired_queues()
-            await asyncio.sleep(3600)
-        except Exception as e:
-            logger.error(f"Ошибка при очистке устаревших очередей: {e}")
-            await asyncio.sleep(3600)
+            next_expiry = await db.cleanup_expired_queues()
+            if next_expiry is not None:
+                delay = min(CLEANUP_INTERVAL, max(1, next_expiry - time.time()))
+        except Exception:
+            logger.exception("Ошибка при очистке устаревших очередей")
+        await asyncio.sleep(delay)
+
+async def run_webhook():
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
 
 async def main():
     await db.init_db()
     
-    cleanup_task_handle = asyncio.create_task(cleanup_task())
+    cleanup_task_handle = run_in_background(cleanup_task())
     
     try:
         logger.info("Запуск бота...")
-        await dp.start_polling(bot)
+        if WEBHOOK_URL:
+            await run_webhook()
+        else:
+            await bot.delete_webhook()
+            await dp.start_polling(bot, polling_timeout=POLLING_TIMEOUT)
     finally:
         cleanup_task_handle.cancel()
+        await db.close()
 
 
 if __name__ == "__main__":
@@ -995,5 +1008,5 @@ if __name__ == "__main__":
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Бот остановлен")
-    except Exception as e:
-        logger.error(f"Критическая ошибка: {e}")
\ No newline at end of file
+    except Exception:
+        logger.exception("Критическая ошибка")
\ No newline at end of file
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Tuple, Type
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import (
+    CopyMessage,
+    ForwardMessage,
+    GetUpdates,
+    SendAnimation,
+    SendAudio,
+    SendContact,
+    SendDice,
+    SendDocument,
+    SendLocation,
+    SendMediaGroup,
+    SendMessage,
+    SendPhoto,
+    SendPoll,
+    SendSticker,
+    SendVenue,
+    SendVideo,
+    SendVideoNote,
+    SendVoice,
+    TelegramMethod,
+)
+from aiogram.methods.base import Response, TelegramType
+
+SEND_METHODS = (
+    SendMessage,
+    SendPhoto,
+    SendDocument,
+    SendAnimation,
+    SendAudio,
+    SendVideo,
+    SendVideoNote,
+    SendVoice,
+    SendSticker,
+    SendMediaGroup,
+    SendLocation,
+    SendVenue,
+    SendContact,
+    SendPoll,
+    SendDice,
+    CopyMessage,
+    ForwardMessage,
+)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    def __init__(
+        self,
+        rate: float = 25,
+        capacity: int = 30,
+        group_rate: float = 20 / 60,
+        group_capacity: int = 20,
+        max_groups: int = 1000,
+        ignore_methods: Tuple[Type[TelegramMethod[Any]], ...] = (GetUpdates,),
+        group_methods: Tuple[Type[TelegramMethod[Any]], ...] = SEND_METHODS
+    ):
+        self.bucket = TokenBucket(rate, capacity)
+        self.group_rate = group_rate
+        self.group_capacity = group_capacity
+        self.max_groups = max_groups
+        self.ignore_methods = ignore_methods
+        self.group_methods = group_methods
+        self._group_buckets: OrderedDict[int, TokenBucket] = OrderedDict()
+    
+    def _group_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._group_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._group_buckets[chat_id] = TokenBucket(self.group_rate, self.group_capacity)
+            if len(self._group_buckets) > self.max_groups:
+                self._group_buckets.popitem(last=False)
+        else:
+            self._group_buckets.move_to_end(chat_id)
+        return bucket
+    
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if isinstance(method, self.ignore_methods):
+            return await make_request(bot, method)
+        
+        if isinstance(method, self.group_methods):
+            chat_id = method.chat_id
+            if isinstance(chat_id, int) and chat_id < 0:
+                await self._group_bucket(chat_id).acquire()
+        
+        await self.bucket.acquire()
+        return await make_request(bot, method)
@@ -1,9 +1,10 @@
 from dataclasses import dataclass
 from datetime import datetime
+from enum import Enum
 from typing import Optional
 
 
-@dataclass
+@dataclass(slots=True)
 class User:
     id: int
     username: str
@@ -11,7 +12,7 @@ class User:
     created_at: datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class Queue:
     id: int
     name: str
@@ -20,10 +21,45 @@ class Queue:
     expires_at: datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class QueueMember:
     queue_id: int
     user_id: int
     position: int
     joined_at: datetime
     user: Optional[User] = None
+
+
+@dataclass(slots=True)
+class UserState:
+    state: str
+    chat_id: int
+    message_id: int
+    queue_id: Optional[int] = None
+
+
+class JoinStatus(Enum):
+    JOINED = "joined"
+    QUEUE_NOT_FOUND = "queue_not_found"
+    ALREADY_MEMBER = "already_member"
+
+
+@dataclass(slots=True)
+class JoinResult:
+    status: JoinStatus
+    queue: Optional[Queue] = None
+    position: int = 0
+    total: int = 0
+
+
+class PopStatus(Enum):
+    POPPED = "popped"
+    QUEUE_NOT_FOUND = "queue_not_found"
+    EMPTY = "empty"
+
+
+@dataclass(slots=True)
+class PopResult:
+    status: PopStatus
+    queue_name: str = ""
+    member: Optional[QueueMember] = None
@@ -0,0 +1,166 @@
+import calendar
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+from database import SCHEMA_VERSION, Database
+from models import JoinStatus, PopStatus
+
+
+class WriteTransactionTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = Database(os.path.join(self.tmpdir.name, "test.db"), readers=1)
+        await self.db.init_db()
+        await self.db.create_user(1, "creator")
+        await self.db.create_user(2, "member")
+        self.queue_id = await self.db.create_queue("Лабораторная", 1)
+    
+    async def asyncTearDown(self):
+        await self.db.close()
+        self.tmpdir.cleanup()
+    
+    async def assert_writer_usable(self):
+        self.assertFalse(self.db._writer.in_transaction)
+        
+        result = await self.db.try_join_queue(self.queue_id, 2)
+        self.assertIs(result.status, JoinStatus.JOINED)
+        
+        result = await self.db.pop_next(self.queue_id)
+        self.assertIs(result.status, PopStatus.POPPED)
+        self.assertEqual(result.member.user_id, 2)
+    
+    async def test_duplicate_user_rolls_back(self):
+        with self.assertRaises(aiosqlite.IntegrityError):
+            await self.db.create_user(2, "member")
+        
+        await self.assert_writer_usable()
+    
+    async def test_unknown_creator_rolls_back(self):
+        with self.assertRaises(aiosqlite.IntegrityError):
+            await self.db.create_queue("Без создателя", 999)
+        
+        await self.assert_writer_usable()
+
+
+LEGACY_SCHEMA = """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY,
+        username TEXT NOT NULL,
+        {surname}
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE queues (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        creator_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP DEFAULT (datetime('now', '+1 day')),
+        FOREIGN KEY (creator_id) REFERENCES users (id)
+    );
+    CREATE TABLE queue_members (
+        queue_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (queue_id, user_id),
+        FOREIGN KEY (queue_id) REFERENCES queues (id) ON DELETE CASCADE,
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+    );
+    CREATE INDEX idx_queue_members_queue_id ON queue_members (queue_id);
+    CREATE INDEX idx_queue_members_position ON queue_members (queue_id, position);
+    CREATE INDEX idx_queues_expires_at ON queues (expires_at);
+"""
+
+
+def unix(text: str) -> int:
+    return calendar.timegm(datetime.datetime.strptime(text, "%Y-%m-%d %H:%M:%S").timetuple())
+
+
+class LegacyMigrationTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "legacy.db")
+        self.db = None
+    
+    async def asyncTearDown(self):
+        if self.db:
+            await self.db.close()
+        self.tmpdir.cleanup()
+    
+    def create_legacy_db(self, with_surname: bool):
+        conn = sqlite3.connect(self.path)
+        conn.executescript(LEGACY_SCHEMA.format(surname="surname TEXT," if with_surname else ""))
+        conn.executemany(
+            "INSERT INTO users (id, username, created_at) VALUES (?, ?, ?)",
+            [(1, "first", "2024-01-02 03:04:05"), (2, "second", "2024-01-02 03:05:00"), (3, "third", "2024-01-02 03:06:00")]
+        )
+        conn.execute(
+            "INSERT INTO queues (id, name, creator_id, created_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (7, "Лабораторная", 1, "2024-01-02 03:10:00", "2024-01-03 03:10:00")
+        )
+        conn.executemany(
+            "INSERT INTO queue_members (queue_id, user_id, position, joined_at) VALUES (?, ?, ?, ?)",
+            [(7, 1, 3, "2024-01-02 03:11:00"), (7, 2, 1, "2024-01-02 03:12:00"), (7, 3, 2, "2024-01-02 03:13:00")]
+        )
+        conn.commit()
+        conn.close()
+    
+    async def migrate(self):
+        self.db = Database(self.path, readers=1)
+        await self.db.init_db()
+    
+    async def assert_migrated(self):
+        db = self.db._writer
+        
+        async with db.execute("PRAGMA user_version") as cursor:
+            self.assertEqual((await cursor.fetchone())[0], SCHEMA_VERSION)
+        
+        async with db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%' ORDER BY name"
+        ) as cursor:
+            indexes = [row[0] for row in await cursor.fetchall()]
+        self.assertEqual(indexes, ["idx_queue_members_cover", "idx_queues_expires_at"])
+        
+        members = await self.db.get_queue_members_with_usernames(7)
+        self.assertEqual(members, [(1, "@second"), (2, "@third"), (3, "@first")])
+        
+        async with db.execute("SELECT user_id, joined_at FROM queue_members ORDER BY seq") as cursor:
+            self.assertEqual(await cursor.fetchall(), [
+                (2, unix("2024-01-02 03:12:00")),
+                (3, unix("2024-01-02 03:13:00")),
+                (1, unix("2024-01-02 03:11:00"))
+            ])
+        
+        async with db.execute("SELECT created_at, expires_at FROM queues WHERE id = 7") as cursor:
+            self.assertEqual(await cursor.fetchone(), (unix("2024-01-02 03:10:00"), unix("2024-01-03 03:10:00")))
+        
+        async with db.execute("SELECT id, created_at FROM users ORDER BY id") as cursor:
+            self.assertEqual(await cursor.fetchall(), [
+                (1, unix("2024-01-02 03:04:05")),
+                (2, unix("2024-01-02 03:05:00")),
+                (3, unix("2024-01-02 03:06:00"))
+            ])
+        
+        await self.db.update_user_surname(1, "Иванов")
+        self.assertEqual((await self.db.get_user(1)).surname, "Иванов")
+    
+    async def test_migrates_baseline_schema(self):
+        self.create_legacy_db(with_surname=True)
+        await self.migrate()
+        await self.assert_migrated()
+    
+    async def test_migrates_schema_without_surname(self):
+        self.create_legacy_db(with_surname=False)
+        await self.migrate()
+        await self.assert_migrated()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("BOT_TOKEN", "42:TEST")
+os.environ["BROADCAST_CHAT_ID"] = ""
+
+import main
+from aiogram.methods import DeleteMessage, SendMessage
+from aiogram.types import Chat, Message, Update, User as TelegramUser
+from database import Database
+from models import UserState
+
+USER_ID = 5
+
+
+class HandleQueueNameTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        main.db = Database(os.path.join(self.tmpdir.name, "test.db"), readers=1)
+        await main.db.init_db()
+        main.user_states.clear()
+        self.requests = []
+        
+        async def make_request(bot, method, timeout=None):
+            self.requests.append(method)
+            return True
+        
+        main.bot.session.make_request = make_request
+    
+    async def asyncTearDown(self):
+        await main.db.close()
+        await main.bot.session.close()
+        self.tmpdir.cleanup()
+    
+    async def send_text(self, text: str):
+        message = Message(
+            message_id=100,
+            date=datetime.datetime.now(),
+            chat=Chat(id=USER_ID, type="private"),
+            from_user=TelegramUser(id=USER_ID, is_bot=False, first_name="Test"),
+            text=text
+        )
+        await main.dp.feed_update(main.bot, Update(update_id=1, message=message))
+    
+    def sent_texts(self):
+        return [method.text for method in self.requests if isinstance(method, SendMessage)]
+    
+    async def test_creates_queue_and_confirms(self):
+        await main.db.create_user(USER_ID, "tester")
+        main.user_states[USER_ID] = UserState("waiting_queue_name", USER_ID, 99)
+        
+        await self.send_text("Лабораторная 1")
+        
+        queues = await main.db.get_all_queues_with_counts()
+        self.assertEqual([queue.name for queue, _ in queues], ["Лабораторная 1"])
+        queue_id = queues[0][0].id
+        
+        texts = self.sent_texts()
+        self.assertEqual(len(texts), 1)
+        self.assertIn(f"🆔 ID очереди: {queue_id}", texts[0])
+        self.assertNotIn(main.MSG_ERROR, texts)
+        
+        deleted = {method.message_id for method in self.requests if isinstance(method, DeleteMessage)}
+        self.assertEqual(deleted, {99, 100})
+        self.assertNotIn(USER_ID, main.user_states)
+    
+    async def test_unregistered_user_is_asked_to_register(self):
+        main.user_states[USER_ID] = UserState("waiting_queue_name", USER_ID, 99)
+        
+        await self.send_text("Лабораторная 2")
+        
+        self.assertEqual(await main.db.get_all_queues_with_counts(), [])
+        self.assertEqual(self.sent_texts(), [main.MSG_NOT_REGISTERED])
+    
+    
+    async def test_start_link_registers_and_joins(self):
+        await main.db.create_user(1, "creator")
+        queue_id = await main.db.create_queue("Лабораторная 3", 1)
+        
+        await self.send_text(f"/start join_{queue_id}")
+        
+        self.assertIsNotNone(await main.db.get_user(USER_ID))
+        self.assertIsNotNone(await main.db.get_queue_member(queue_id, USER_ID))
+        self.assertIn("✅ Ты добавлен в очередь 'Лабораторная 3'!\n\n🎯 Позиция: 1 из 1", self.sent_texts())
+
+
+if __name__ == "__main__":
+    unittest.main()